@@ -0,0 +1,96 @@
+'''
+microbenchmark for the record types used on the sorting and printing paths
+
+compares
+1. building a namedtuple class on every call (how get_HH_summary() et al.
+used to work) against the module level namedtuples
+2. the size of Person, Visit, Delivery_Household and Route_Summary objects
+with __slots__ against the same classes with an instance __dict__
+
+run it from the top of the repo so the modules can be imported
+python3 Testing/bench_records.py
+'''
+
+import sys
+import timeit
+import tracemalloc
+from collections import namedtuple
+
+sys.path.insert(0, '.')
+
+from db_data_models import Person
+from db_data_models import Visit
+from db_data_models import visit_sum
+from basket_sorting_Geocodes import Delivery_Household
+from basket_sorting_Geocodes import Route_Summary
+
+N_CALLS = 20000 # calls timed for each summary
+N_OBJECTS = 10000 # objects made for each memory test
+
+SUMMARY = (123, 'Jane', 'Doe', 4, '519-555-1212', 'jane@example.com',
+           '12 King St', '', 'Kitchener', 'N2G 1A1', 'Vegetarian', 12,
+           '5195551212')
+PERSON = (456, 'Doe', 'John', '2001-01-01', 18, 'Male', 'Undisclosed',
+          'Undisclosed', 'Child', None)
+
+def per_call_summary():
+    '''
+    the old way - a new class every time a summary is returned
+    '''
+    v_sum = namedtuple('visit_sum', 'applicant, fname, lname, size, phone, email,\
+                       address, address2, city, postal, diet, sa_app_num, sms_target')
+    return v_sum(*SUMMARY)
+
+def module_summary():
+    '''
+    the new way - the class from db_data_models
+    '''
+    return visit_sum(*SUMMARY)
+
+def unslotted(cls):
+    '''
+    returns a subclass of cls that has an instance __dict__ again
+    which is what the class looked like before it had __slots__
+    '''
+    return type(f'{cls.__name__}_dict', (cls,), {})
+
+def make_person(cls):
+    return cls(PERSON)
+
+def make_visit(cls):
+    return cls(1, '2019-12-01', 123, (456,), 789, ('12 King St', 'Kitchener', 'N2G 1A1'))
+
+def make_household(cls):
+    return cls(123, 789, 4, 43.45, -80.49, visit_sum(*SUMMARY), 'Downtown',
+               rn=1, rl='A')
+
+def make_summary(cls):
+    return cls(1)
+
+def allocated(factory, cls):
+    '''
+    returns the bytes allocated making N_OBJECTS with factory(cls)
+    '''
+    tracemalloc.start()
+    objects = [factory(cls) for _ in range(N_OBJECTS)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size
+
+if __name__ == '__main__':
+    before = min(timeit.repeat(per_call_summary, number=N_CALLS, repeat=3))
+    after = min(timeit.repeat(module_summary, number=N_CALLS, repeat=3))
+    print(f'visit summary x {N_CALLS}')
+    print(f'  class per call: {before * 1e6 / N_CALLS:8.2f} us/call')
+    print(f'  module level:   {after * 1e6 / N_CALLS:8.2f} us/call')
+
+    print(f'memory for {N_OBJECTS} objects')
+    for factory, cls in ((make_person, Person),
+                         (make_visit, Visit),
+                         (make_household, Delivery_Household),
+                         (make_summary, Route_Summary)):
+        with_dict = allocated(factory, unslotted(cls))
+        with_slots = allocated(factory, cls)
+        print(f'  {cls.__name__:20} __dict__: {with_dict / N_OBJECTS:6.0f} B'
+              f'  __slots__: {with_slots / N_OBJECTS:6.0f} B')
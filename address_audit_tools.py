@@ -11,6 +11,7 @@
 import usaddress
 import logging
 from collections import namedtuple
+from functools import lru_cache
 
 address_audit_log = logging.getLogger(__name__)
 address_audit_log.setLevel(logging.INFO)
@@ -20,10 +21,40 @@ address_log_file_handler = logging.FileHandler(r'Logging/address_audit_errors.lo
 address_log_file_handler.setFormatter(address_log_formatter)
 address_audit_log.addHandler(address_log_file_handler)
 
-def parse_post_types(address):
+# returned by evaluate_post_types
+PT_package = namedtuple('Pt_package', 'status, error_free, sn_error, dt_error, fl_error')
+
+# street name types and directions grouped by their first letter
+# used by post_types_from_tags() to decide if a tag is one we expect
+STREET_TYPES = {'a': ('avenue', 'ave', 'av'),
+                'b': ('boulevard','blvd','bend', 'boul', 'blvrd'),
+                'c': ('ct', 'crt','crest','crescent','cres','cr','court','circle', 'crcl', 'cir', 'cl'),
+                'd': ('drive', 'dr', 'drv'),
+                'f': ('field', 'feild'),
+                'g': ('green','gate'),
+                'h': ('hwy', 'highway', 'heights'),
+                'l': ('lane', 'ln', 'line'),
+                'p': ('place', 'pl', 'pkway', 'pkwy', 'pk', 'parkway', 'park'),
+                'r': ('road', 'ridge', 'rd'),
+                's': ('street', 'st', 'st n', 'square', 'springs'),
+                't': ('trail', 'terrace','terr'),
+                'v': ('view'),
+                'w': ('way', 'walk')}
+DIRECTIONS = {'n': ('north', 'n', 'nor', 'nth'),
+              's': ('south', 's'),
+              'e': ('east', 'e'),
+              'w': ('west', 'w', 'wst')}
+
+POST_TYPE_CACHE_SIZE = 4096 # google addresses kept by parse_post_types
+# usaddress tags that address_builder does not put in the simplified address
+DROPPED_TAGS = ('StreetNamePreType',)
+
+def post_types_from_tags(tags, type_tag, address=None):
     '''
     This function provides output indicating the presence and equivalency of 
     different post street name types (ave, street etc) and directions (east, south etc.)
+    from the (tags, type_tag) tuple that usaddress.tag() returns, so the
+    tagging done to parse an address can be reused here
 
     The variation in street types and directions does not vary much for most of the letters
     so if 123 Queen Street East is input in one place we can test equivalence 
@@ -33,55 +64,25 @@ def parse_post_types(address):
     returns a tuple ((streetnameptype, street_key), (streetnamepdir, dir_key), eval_flag)
     eval_flag indicates the presence of an unmapped or potentially wrong usadress tag outcome
     '''
-    
-    street_types = {'a': ('avenue', 'ave', 'av'),
-                  'b': ('boulevard','blvd','bend', 'boul', 'blvrd'),
-                  'c': ('ct', 'crt','crest','crescent','cres','cr','court','circle', 'crcl', 'cir', 'cl'),
-                  'd': ('drive', 'dr', 'drv'),
-                  'f': ('field', 'feild'),
-                  'g': ('green','gate'),
-                  'h': ('hwy', 'highway', 'heights'),
-                  'l': ('lane', 'ln', 'line'),
-                  'p': ('place', 'pl', 'pkway', 'pkwy', 'pk', 'parkway', 'park'),
-                  'r': ('road', 'ridge', 'rd'),
-                  's': ('street', 'st', 'st n', 'square', 'springs'),
-                  't': ('trail', 'terrace','terr'),
-                  'v': ('view'),
-                  'w': ('way', 'walk')}
-    directions = {'n': ('north', 'n', 'nor', 'nth'),
-                  's': ('south', 's'),
-                  'e': ('east', 'e'),
-                  'w': ('west', 'w', 'wst')}
-
     streetnameptype = False # ave st etc. are present
     streetnamepdir = False # north south east etc. are present
     eval_flag = False # is there a mismatch in the pt or dir keys?  An error or an outlier? Flag for followup
     street_key = None # what is the first letter of street type?
     dir_key = None # what is the first letter of the direction tag e.g. north?
-    tagged_address = usaddress.tag(address)
-    tags, type_tag = tagged_address
     if type_tag == 'Street Address':
-        if 'StreetNamePostType' in tags.keys():
-            tag_value = tags['StreetNamePostType']
+        tag_value = tags.get('StreetNamePostType')
+        if tag_value is not None:
             street_key = tag_value[0].lower() # Street becomes s
-            if street_key in street_types.keys():
-                tvalue = tag_value.lower()
-                if tvalue in street_types[street_key]:
-                    streetnameptype = True
-                else:
-                    eval_flag = True
+            if tag_value.lower() in STREET_TYPES.get(street_key, ()):
+                streetnameptype = True
             else:
                 eval_flag = True
 
-        if 'StreetNamePostDirectional' in tags.keys():    
-            tag_value = tags['StreetNamePostDirectional']
+        tag_value = tags.get('StreetNamePostDirectional')
+        if tag_value is not None:
             dir_key = tag_value[0].lower()
-            if dir_key in directions.keys():
-                tv = tag_value.lower()
-                if tv in directions[dir_key]:
-                    streetnamepdir = True
-                else:
-                    eval_flag = True 
+            if tag_value.lower() in DIRECTIONS.get(dir_key, ()):
+                streetnamepdir = True
             else:
                 eval_flag = True
         return ((streetnameptype, street_key), (streetnamepdir, dir_key), eval_flag)
@@ -90,6 +91,31 @@ def parse_post_types(address):
         address_audit_log.error('attempting to parse post types. Got invalid tag response for {}'.format(address))
         return (None, None, True)    
 
+def source_post_types(tags, type_tag, address=None):
+    '''
+    post_types_from_tags() for a source address.  address_builder() drops
+    the tags in DROPPED_TAGS so a source address that has one of them, or
+    that has no street name at all, comes out mangled (i.e. 116 Erb #10
+    becomes 116 10) and the eval_flag is set to hold it back for followup
+    '''
+    post_types = post_types_from_tags(tags, type_tag, address)
+    pt, dt, eval_flag = post_types
+    if not eval_flag and ('StreetName' not in tags or
+                          any(tag in tags for tag in DROPPED_TAGS)):
+        address_audit_log.error('source address {} has tags that are dropped from the simplified address'.format(address))
+        return (pt, dt, True)
+    return post_types
+
+@lru_cache(maxsize=POST_TYPE_CACHE_SIZE)
+def parse_post_types(address):
+    '''
+    tags the address string with usaddress and returns the
+    post_types_from_tags() tuple for it.  Used for the google addresses
+    which come back the same for every household at that address
+    '''
+    tags, type_tag = usaddress.tag(address)
+    return post_types_from_tags(tags, type_tag, address)
+
 def evaluate_post_types(source_types, db_types):
     '''
     Takes two results from parse_post_types and evaluates equavelence
@@ -105,7 +131,6 @@ def evaluate_post_types(source_types, db_types):
     sn_error = False # street name error
     dt_error = False # direction type error
     fl_error = False # eval_flag mismatch
-    PT_package = namedtuple('Pt_package', 'status, error_free, sn_error, dt_error, fl_error')
     try:
         source_nt_tpl, source_dt_tpl, s_e_flag = source_types
         db_nt_tpl, db_dt_tpl, db_e_flag = db_types        
@@ -25,22 +25,32 @@ about errors with the address
 
 import csv
 import googlemaps
-from collections import namedtuple, defaultdict
+import hashlib
+from collections import namedtuple, defaultdict, OrderedDict, Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 import usaddress
 import string
 import sqlite3
-from time import gmtime, strftime, sleep
+import threading
+from time import gmtime, strftime, sleep, monotonic
 import logging
+import os
 import re
 import sys
+import argparse
+from urllib.request import pathname2url
 
 from r_config import configuration
 
 from db_data_models import Field_Names
 from db_data_models import Visit_Line_Object
 from db_data_models import Export_File_Parser
+from db_data_models import normalizer_stats
 from address_audit_tools import parse_post_types
+from address_audit_tools import source_post_types
 from address_audit_tools import evaluate_post_types
+from address_audit_tools import STREET_TYPES
 from address_audit_tools import flag_checker
 from address_audit_tools import two_city_parser
 from address_audit_tools import post_type_logger
@@ -49,8 +59,10 @@ from address_audit_tools import write_to_logs
 from address_audit_tools import boundary_checker
 from address_audit_tools import boundary_logger
 from address_audit_tools import missing_unit_logger
+from db_migrations import migrate
 
 from file_iface import Menu
+from kw_neighbourhoods import Neighbourhoods
 
 config = configuration.return_r_config()
 
@@ -59,7 +71,53 @@ add_base = config.get_bases()['address']
     #api key
 myapikey = config.get_g_creds()
 # INSTANTIATE GOOGLE MAPS CLIENT
-gmaps = googlemaps.Client(key=myapikey)
+# the client is told not to retry OVER_QUERY_LIMIT on its own so that
+# returnGeocoderResult can back off and report when it gives up
+gmaps = googlemaps.Client(key=myapikey, retry_over_query_limit=False)
+
+# GEOCODING RATE LIMITS
+GEOCODE_RATE = 10 # requests per second shared by all the geocoding threads
+GEOCODE_WORKERS = 4 # threads geocoding ahead of the line being processed
+GEOCODE_CHUNK = 100 # lines read ahead of the line being processed
+OVER_LIMIT_RETRIES = 5 # times to back off and retry an OVER_QUERY_LIMIT
+AT_LIMIT_STATUSES = ('OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT')
+HASH_BLOCK = 1 << 20 # bytes read at a time when hashing a source file
+# the neighbourhood of each coordinate is worked out once when it is written
+# to the address database and kept in its neighbourhood table
+NEIGHBOURHOOD_SHAPES = 'City of Waterloo and Kitchener Planning district Geometry.json'
+
+# ADDRESS PARSE CACHE LIMITS
+PARSE_CACHE_SIZE = 50000 # parsed addresses kept by an AddressParser
+PARSE_ERROR_CACHE_SIZE = 10000 # addresses that could not be parsed
+
+# ADDRESS PARSE STORE
+# results of full_address_parser are kept between runs in PARSE_STORE_NAME
+# next to the address database.  Bump PARSER_VERSION whenever a change to
+# scrub_bad_formats_from, address_builder or usaddress would change the
+# result for an address so that the old results are thrown out
+PARSER_VERSION = 2
+PARSE_STORE_NAME = 'Parse_Cache.db'
+PARSE_STORE_BATCH = 500 # new results held in memory before they are written
+# FAST PATH ADDRESS TAGGING
+# most source addresses look like 123 King St W or 12-345 Weber Street North
+# tag_address() splits those up itself instead of calling usaddress.tag().
+# The first address of each shape on a street is still tagged by usaddress
+# and the fast path is only used for that street if the tags came out the same
+USE_FAST_PATH = True
+FAST_PATH_MAX_STREETS = 20000 # street shapes remembered by tag_address()
+FAST_NUMBER_RE = re.compile(r'(?:\d+-)?\d+[A-Za-z]?') # 12 12A 12-345
+FAST_NAME_RE = re.compile(r"[A-Za-z][A-Za-z'-]*")
+FAST_DIRECTIONS = frozenset(usaddress.DIRECTIONS)
+FAST_STREET_TYPES = frozenset(usaddress.STREET_NAMES).union(
+    *(t for t in STREET_TYPES.values() if isinstance(t, tuple)))
+# the address parse log line for each error code full_address_parser returns
+PARSE_ERROR_LOGS = {'address_type Error': '##71## Could not derive Street Address from {}',
+                    'RepeatedLabelError': '##72## RepeatedLabelError from {}',
+                    'KeyError': '##73## KeyError from {}',
+                    'Blank Field Error': '##74## Blank Field Error from {}'}
+PARSE_STORE_COLUMNS = ('raw', 'version', 'worked', 'in_put', 'result',
+                       'multi_unit', 'direction', 'post_type', 'pt_type',
+                       'pt_key', 'dir_type', 'dir_key', 'pt_eval')
 
 # LOGGING
 
@@ -96,6 +154,16 @@ errors_log_fh = logging.FileHandler(r'Logging/parse_gcode_errors.log')
 errors_log_fh.setFormatter(errors_log_format)
 errors_log.addHandler(errors_log_fh)
 
+# NAMED TUPLES
+# defined once here rather than inside the methods that return them
+# so that a new class isn't built every time a line is processed
+usaparsed_street_address = namedtuple('usaparsed_street_address','flag original return_value')
+address_tpl = namedtuple('address_tpl', 'g_address_str, house_number, street, city, lat, lng')
+Coord_package = namedtuple('Coord_package', 'lat, lng, source, exists, status, address, city, neighbourhood')
+Flag_pack = namedtuple('Flag_pack', 'valid, error_free, unit_flag, dir_flag, post_type')
+Package = namedtuple('Package', 'status, lat, lng')
+null_tuple = namedtuple('null_tuple', 'status, error_free, sn_error, dt_error, fl_error')
+
 class GoogleResult:
     '''
     Takes the json returned by the google maps geocoding api and exposes
@@ -259,119 +327,556 @@ def scrub_bad_formats_from(address):
     else:
         return address
 
+fast_path_streets = {} # (number shape, street tokens): True if usaddress agreed
+fast_path_counts = Counter() # 'fast' and 'crf' taggings done by tag_address()
+
+def fast_path_tags(addr):
+    '''
+    splits an address of the form number name [name...] type [direction]
+    into a dictionary of usaddress tags and returns it with the
+    (number shape, street tokens) key that is used to check it against
+    usaddress.  The key holds everything usaddress.tag() would see so
+    addresses with the same key are tagged the same way.
+    Returns None for anything else
+    '''
+    tokens = addr.split()
+    if len(tokens) < 3 or not FAST_NUMBER_RE.fullmatch(tokens[0]):
+        return None
+    direction = None
+    street = tokens[1:]
+    if street[-1].lower() in FAST_DIRECTIONS:
+        direction = street[-1]
+        street = street[:-1]
+    if len(street) < 2 or street[-1].lower() not in FAST_STREET_TYPES:
+        return None
+    for word in street[:-1]:
+        lword = word.lower()
+        if (not FAST_NAME_RE.fullmatch(word) or lword in FAST_STREET_TYPES
+                or lword in FAST_DIRECTIONS):
+            return None
+    tags = {'AddressNumber': tokens[0],
+            'StreetName': ' '.join(street[:-1]),
+            'StreetNamePostType': street[-1]}
+    if direction:
+        tags['StreetNamePostDirectional'] = direction
+    number = tokens[0]
+    if number.isdigit():
+        # usaddress only looks at the length and trailing zeros of a number
+        shape = (len(number), len(number) - len(number.rstrip('0')))
+    else:
+        # but 12A and 12-345 are looked at as words
+        shape = number.lower()
+    return tags, (shape, tuple(tokens[1:]))
+
+def tag_address(addr):
+    '''
+    returns the (tags, address type) tuple that usaddress.tag(addr) would
+    using fast_path_tags() when the street has already been checked
+    '''
+    fast = fast_path_tags(addr) if USE_FAST_PATH else None
+    if fast is None:
+        fast_path_counts['crf'] += 1
+        return usaddress.tag(addr)
+    tags, key = fast
+    agrees = fast_path_streets.get(key)
+    if agrees:
+        fast_path_counts['fast'] += 1
+        return tags, 'Street Address'
+    fast_path_counts['crf'] += 1
+    tagged_address = usaddress.tag(addr)
+    if agrees is None and len(fast_path_streets) < FAST_PATH_MAX_STREETS:
+        fast_path_streets[key] = (tagged_address[1] == 'Street Address' and
+                                  dict(tagged_address[0]) == tags)
+    return tagged_address
+
+def fast_path_stats(reset=False):
+    '''
+    returns the number of addresses tagged by the fast path and by usaddress
+    and the fast path hit rate.  reset=True starts the counts again which
+    lets the ops_sort workers send back the counts for each chunk
+    '''
+    fast, crf = fast_path_counts['fast'], fast_path_counts['crf']
+    if reset:
+        fast_path_counts.clear()
+    return {'fast': fast, 'crf': crf,
+            'hit_rate': fast / (fast + crf) if fast + crf else 0.0}
+
+def add_fast_path_stats(stats):
+    '''
+    adds the counts from a fast_path_stats() result made in another process
+    '''
+    fast_path_counts['fast'] += stats['fast']
+    fast_path_counts['crf'] += stats['crf']
+
+def log_parse_error(error, file_id):
+    '''
+    writes the ##7x## line for the error code full_address_parser returned
+    for file_id to the address parse log.  These lines are how the
+    addresses that need fixing in l2f are found, so they are written again
+    for every run, even when the failure came out of the Parse_Store
+    '''
+    address_str_parse_logger.error(PARSE_ERROR_LOGS.get(error, '##70## Parse Error from {}').format(file_id))
+
 def full_address_parser(address, file_id):
     '''
     takes a street address e.g. 123 Main Street and attempts to break it into 
     the relevant chunks
     usaddress.tag() returns a tuple of (OrderedDict, str) with the str being a designator of typex
+    (tag_address() skips it for the simple addresses it has checked)
+    the same tags are used for the street type and direction checks which
+    go in error_flags['PostTypes'] so the address is only tagged once
     :returns: a tuple (True, original address, (parsed address, error_flags)) 
               or (False, original address, error code)       
     '''
     
     addr = scrub_bad_formats_from(address)
-    usaparsed_street_address = namedtuple('usaparsed_street_address','flag original return_value')
     if addr:
         try:
-            tagged_address, address_type = usaddress.tag(addr)
+            tagged_address, address_type = tag_address(addr)
             if address_type == 'Street Address':
                 # parse the address with the other helper functions
                 p_add = address_builder(tagged_address) # tuple of (parsed address, flags)
+                # the street type and direction checks use the same tags
+                p_add[1]['PostTypes'] = source_post_types(tagged_address,
+                                                          address_type, addr)
                 address_str_parse_logger.info('##80## Parsed {} with result {}'.format(file_id, p_add[0]))
                 return usaparsed_street_address(True, addr, p_add)
             else:                
                 # log address format error and flag for manual follow up
-                address_str_parse_logger.error('##71## Could not derive Street Address from {}'.format(file_id))
+                log_parse_error('address_type Error', file_id)
                 return usaparsed_street_address(False, addr, 'address_type Error')
         except KeyboardInterrupt:
             raise
         except usaddress.RepeatedLabelError:
             # log address format error and flag for manual follow up
-            address_str_parse_logger.error('##72## RepeatedLabelError from {}'.format(file_id))            
+            log_parse_error('RepeatedLabelError', file_id)
             return usaparsed_street_address(False, addr, 'RepeatedLabelError')
         except KeyError:
-            address_str_parse_logger.error('##73## KeyError from {}'.format(file_id))
+            log_parse_error('KeyError', file_id)
             return usaparsed_street_address(False, addr, 'KeyError')            
             
     else:
-        address_str_parse_logger.error('##74## Blank Field Error from {}'.format(file_id))
+        log_parse_error('Blank Field Error', file_id)
         return usaparsed_street_address(False, addr, 'Blank Field Error')
         # we can just skip blank lines
 
-def returnGeocoderResult(address):
+class Parse_Store():
+    '''
+    an sqlite table of full_address_parser results from earlier runs
+    keyed on the raw address string and the PARSER_VERSION so that a
+    warm run never has to call usaddress.tag() for an address it has
+    seen before
+
+    the connection is opened on first use and reopened if the object
+    finds itself in a forked process, so one can be made at the top of a
+    script and used by the worker processes in ops_sort
+    '''
+    def __init__(self, name, version=PARSER_VERSION, batch=PARSE_STORE_BATCH):
+        self.name = name
+        self.version = version
+        self.batch = batch
+        self.conn = None
+        self.pid = None
+        self.inherited = [] # connections copied from the parent process
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def connection(self):
+        if self.conn is not None and self.pid == os.getpid():
+            return self.conn
+        if self.conn is not None:
+            # belongs to the parent process.  keep a reference so that it
+            # is never closed from here and start again with a new one
+            self.inherited.append(self.conn)
+            self.pending = []
+        self.conn = sqlite3.connect(self.name, timeout=30)
+        self.pid = os.getpid()
+        columns = [x[1] for x in self.conn.execute('PRAGMA table_info(parse_cache)')]
+        if columns and columns != list(PARSE_STORE_COLUMNS):
+            # made by an older version of this class.  it is only a cache
+            self.conn.execute('DROP TABLE parse_cache')
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS parse_cache (raw TEXT,
+                                                                     version INTEGER,
+                                                                     worked BOOLEAN,
+                                                                     in_put TEXT,
+                                                                     result TEXT,
+                                                                     multi_unit BOOLEAN,
+                                                                     direction BOOLEAN,
+                                                                     post_type BOOLEAN,
+                                                                     pt_type BOOLEAN,
+                                                                     pt_key TEXT,
+                                                                     dir_type BOOLEAN,
+                                                                     dir_key TEXT,
+                                                                     pt_eval BOOLEAN,
+                                                                     PRIMARY KEY (raw, version))""")
+        self.conn.execute('DELETE FROM parse_cache WHERE version != ?',
+                          (self.version,))
+        self.conn.commit()
+        migrate(self.conn)
+        return self.conn
+
+    def get(self, address):
+        '''
+        returns the usaparsed_street_address stored for address
+        or None if it has not been parsed with this version
+        '''
+        row = self.connection().execute("""SELECT worked, in_put, result,
+                                           multi_unit, direction, post_type,
+                                           pt_type, pt_key, dir_type, dir_key,
+                                           pt_eval
+                                           FROM parse_cache
+                                           WHERE raw = ? AND version = ?""",
+                                        (address, self.version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        worked, in_put, result, multi_unit, direction, post_type = row[:6]
+        if worked:
+            pt_type, pt_key, dir_type, dir_key, pt_eval = row[6:]
+            flags = {'MultiUnit': bool(multi_unit),
+                     'Direction': bool(direction),
+                     'PostType': bool(post_type),
+                     'PostTypes': ((bool(pt_type), pt_key),
+                                   (bool(dir_type), dir_key),
+                                   bool(pt_eval))}
+            return usaparsed_street_address(True, in_put, (result, flags))
+        return usaparsed_street_address(False, in_put, result)
+
+    def put(self, address, parse):
+        '''
+        queues the usaparsed_street_address parse for address to be written
+        '''
+        self.connection()
+        worked, in_put, out_put = parse
+        if worked:
+            result, flags = out_put
+            (pt_type, pt_key), (dir_type, dir_key), pt_eval = flags['PostTypes']
+            self.pending.append((address, self.version, True, in_put, result,
+                                 flags['MultiUnit'], flags['Direction'],
+                                 flags['PostType'], pt_type, pt_key,
+                                 dir_type, dir_key, pt_eval))
+        else:
+            self.pending.append((address, self.version, False, in_put, out_put)
+                                + (None,) * 8)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            conn = self.connection()
+            conn.executemany("""INSERT OR REPLACE INTO parse_cache
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             self.pending)
+            conn.commit()
+            self.pending = []
+
+    def stats(self):
+        asked = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / asked if asked else 0.0}
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.flush()
+            self.conn.close()
+        self.conn = None
+
+def parse_store_for(address_db):
+    '''
+    returns a Parse_Store in the same folder as the address_db file
+    '''
+    return Parse_Store(os.path.join(os.path.dirname(address_db), PARSE_STORE_NAME))
+
+def stored_address_parser(address, file_id, store=None):
+    '''
+    full_address_parser() that looks in the Parse_Store store first and
+    saves anything it had to parse there for next time
+    '''
+    if store is None or not isinstance(address, str):
+        return full_address_parser(address, file_id)
+    parse = store.get(address)
+    if parse is None:
+        parse = full_address_parser(address, file_id)
+        store.put(address, parse)
+    elif not parse.flag:
+        log_parse_error(parse.return_value, file_id) # as if it had been parsed
+    return parse
+
+## Geocoding ##
+
+class Token_Bucket():
+    '''
+    a token bucket rate limiter that can be shared between threads
+    tokens drip into the bucket at rate per second up to capacity and
+    every call to the geocoder has to .take() one first.  When the bucket
+    is empty .take() sleeps until the next token arrives
+    '''
+    def __init__(self, rate=GEOCODE_RATE, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+class Google_Geocoder():
+    '''
+    the geocoding backend used in production.  It wraps a googlemaps.Client
+    and returns the list of results from the api
+    '''
+    def __init__(self, client):
+        self.client = client
+
+    def geocode(self, address):
+        return self.client.geocode(address)
+
+class Stub_Geocoder():
+    '''
+    a stand in for google so that the geocoding steps can be run in testing
+    without a key or spending api calls
+    param responses is a dictionary of {'address string': result} where
+    result is a google style result dictionary (see .result()) or an
+    exception to raise i.e. googlemaps.exceptions.ApiError('OVER_QUERY_LIMIT')
+    addresses that are not in responses come back with no results
+    '''
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.calls = [] # the addresses it was asked for
+
+    @staticmethod
+    def result(lat, lng, number, street, city, postal=None):
+        '''
+        returns a dictionary shaped like one result from the google api
+        '''
+        components = [{'long_name': number, 'types': ['street_number']},
+                      {'long_name': street, 'types': ['route']},
+                      {'long_name': city, 'types': ['locality']}]
+        if postal:
+            components.append({'long_name': postal, 'types': ['postal_code']})
+        return {'address_components': components,
+                'formatted_address': f'{number} {street}, {city}, ON, Canada',
+                'geometry': {'location': {'lat': lat, 'lng': lng}},
+                'place_id': f'stub_{lat}_{lng}',
+                'types': ['street_address']}
+
+    def geocode(self, address):
+        self.calls.append(address)
+        response = self.responses.get(address, None)
+        if isinstance(response, Exception):
+            raise response
+        if response:
+            return [response]
+        return []
+
+geocoder_backend = Google_Geocoder(gmaps)
+rate_limiter = Token_Bucket(GEOCODE_RATE)
+
+def file_hash(path):
+    '''
+    returns the sha1 hex digest of the file at path
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunks(iterable, size):
+    '''
+    yields lists of up to size items from iterable
+    '''
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+def returnGeocoderResult(address, backend=None, bucket=None,
+                         retries=OVER_LIMIT_RETRIES):
     """
     this function takes an address and passes it to googles geocoding
-    api with the help of the googles library
+    api with the help of the googles library (or whichever backend is
+    passed in, the module geocoder_backend by default)
+    every call takes a token from bucket (the module rate_limiter by
+    default) so that threads calling this at the same time stay under the
+    rate limit
+    an OVER_QUERY_LIMIT is retried up to retries times, doubling the wait
+    each time
     it returns a 2 tuple of (True, geocoder object wrapped around the json response) OR
-    (False, None) if we are at the free query limit or some major exception 
-    happens in the try block
+    (False, None) if we are at the free query limit and the retries are
+    used up
     or (None, None) if there is an error with the api (sometimes it just does
-    not work)
+    not work) or no result
     """
-    try:
-        sleep(1)
-        print(address)
-        response = gmaps.geocode(address) 
-        result = None
+    backend = backend or geocoder_backend
+    bucket = bucket or rate_limiter
+    backoff = 1
+    for attempt in range(retries + 1):
         try:
-            result = GoogleResult(response[0])
-        except Exception as result_fail:
-            print(f'result failed: with \n{result_fail}')
-        if result.status == 'OK':
-            print('status OK')
-            return (True, result)
-        else:
-            print('failed')
+            bucket.take()
+            print(address)
+            response = backend.geocode(address)
+            result = None
+            try:
+                result = GoogleResult(response[0])
+            except Exception as result_fail:
+                print(f'result failed: with \n{result_fail}')
+            if result and result.status == 'OK':
+                print('status OK')
+                return (True, result)
+            else:
+                print('failed')
+
+                return (None, None) 
+        except KeyboardInterrupt:
+            raise
+        except Exception as boo:
+            status = getattr(boo, 'status', None)
+            if status == 'OVER_QUERY_LIMIT' and attempt < retries:
+                geocoding_logger.info(f'##401## OVER_QUERY_LIMIT from {address} retrying in {backoff}s')
+                sleep(backoff)
+                backoff *= 2
+                continue
+            print(f'it failed: {boo}')
+            geocoding_logger.critical('##400## Try Block in returnGeocoderResult raised Exception {} from {}'.format(boo, address))
+            if status in AT_LIMIT_STATUSES:
+                return (False, None)
+            return (None, None)
+
+
+class Parse_Cache():
+    '''
+    a dictionary with a size limit that throws out the least recently
+    used entry when it is full and counts how often it is asked for
+    something it has
+    '''
+    __slots__ = ('size', 'store', 'hits', 'misses')
 
-            return (None, None) 
-    except KeyboardInterrupt:
-        raise
-    except Exception as boo:
-        print(f'it failed: {boo}')
-        geocoding_logger.critical('##400## Try Block in returnGeocoderResult raised Exception {} from {}'.format(boo, address))
-        return False
+    def __init__(self, size):
+        self.size = size
+        self.store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, key, default=None):
+        '''
+        returns the value for key and marks it as recently used
+        or default if it is not in the cache
+        '''
+        try:
+            value = self.store[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.store.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.store[key] = value
+        self.store.move_to_end(key)
+        if len(self.store) > self.size:
+            self.store.popitem(last=False)
+
+    def stats(self):
+        asked = self.hits + self.misses
+        return {'size': len(self.store),
+                'limit': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / asked if asked else 0.0}
 
 
 class AddressParser():
     '''
     parses addresses using the address parsing functions
     and provides methods to manage the valid and invalid addresses
+    results are cached against the address string that was passed in
+    so repeat addresses in a file are only parsed once.  addresses that
+    could not be parsed are kept in their own smaller cache
+
+    with a Parse_Store the results are also kept on disk between runs
     '''
 
-    def __init__(self):
-        self.errors = {} # cache of errors on the run throught the active file
-        self.parsed = {} # cache of values on the run through the active file
+    def __init__(self, size=PARSE_CACHE_SIZE, error_size=PARSE_ERROR_CACHE_SIZE,
+                 store=None):
+        self.errors = Parse_Cache(error_size) # address: error code
+        self.parsed = Parse_Cache(size) # address: (parsed_address, flags)
+        self.store = store
 
     def parse(self, address, file_id=None):
         '''
         give it an address with extraneous details and it will give you
         a tuple of  ('unit number street', error_flags) or False
         '''
-        key_list = list(self.errors.keys()) + list(self.parsed.keys())
         meta_log.info(f'attempting to parse {address}')
-        if address not in key_list and address is not (False or None):            
-            worked, in_put, out_put  = full_address_parser(address, file_id)
-            
-            if worked:                
-                self.parsed[in_put] = out_put # tuple of (parsed_address, flags)
-                return out_put 
-            else:
-                self.errors[in_put] = out_put
-                return False
+        if address is None:
+            return False
+        out_put = self.parsed.get(address)
+        if out_put is not None:
+            return out_put
+        if self.errors.get(address) is not None:
+            return False
+
+        worked, _, out_put  = stored_address_parser(address, file_id,
+                                                    self.store)
+        if worked:
+            self.parsed.put(address, out_put) # tuple of (parsed_address, flags)
+            return out_put
         else:
-            if address in self.errors:
-                return False
-            elif address == (False or None):
-                return False
-            else:
-                return self.parsed[address]
-    
+            self.errors.put(address, out_put)
+            return False
+
+    def cache_stats(self):
+        '''
+        returns the hit rates and sizes of the parsed and error caches
+        '''
+        stats = {'parsed': self.parsed.stats(), 'errors': self.errors.stats(),
+                 'fast_path': fast_path_stats()}
+        if self.store:
+            stats['store'] = self.store.stats()
+        return stats
+
+    def flush(self):
+        '''
+        writes any new results waiting to go into the Parse_Store
+        '''
+        if self.store:
+            self.store.flush()
+
+    def close(self):
+        if self.store:
+            self.store.close()
+
     def return_simple_address(self, source_address, file_id):
         '''
         this function sidesteps the error checking steps
         and just tries to simplify an address string
         '''
         try:
-            _, _, parsed_address = full_address_parser(source_address, file_id)
+            _, _, parsed_address = stored_address_parser(source_address, file_id,
+                                                         self.store)
             simple_address, _ = parsed_address
             return simple_address
         except KeyboardInterrupt:
@@ -390,9 +895,21 @@ class Coordinates():
     '''
     provides a method for looking up an address via the google api
     and attributes to store information about that process    
+
+    param backend is the geocoder (Google_Geocoder, Stub_Geocoder) and
+    defaults to the module geocoder_backend
+    param workers is the number of threads .prefetch() geocodes with. With
+    1 worker every address is geocoded when .lookup() asks for it, unless
+    .prefetch() is told to code them up front with serial=True
+    param bucket is the Token_Bucket that limits the request rate
     '''
-    def __init__(self):
+    def __init__(self, backend=None, workers=1, bucket=None):
         self.api_key = myapikey
+        self.backend = backend or geocoder_backend
+        self.bucket = bucket or rate_limiter
+        self.workers = workers
+        self.executor = None # ThreadPoolExecutor started by .prefetch()
+        self.pending = {} # {address: future} from .prefetch()
         self.can_proceed = True
         self.calls = 0
         self.coordinates = {}
@@ -413,7 +930,6 @@ class Coordinates():
         if the function returns None some non fatal error 
         has been returned by google - better luck next time?
         '''
-        address_tpl = namedtuple('address_tpl', 'g_address_str, house_number, street, city, lat, lng')
         if address is None:
             meta_log.info('blank address provided to Coordinates.lookup() method')
             return address
@@ -421,8 +937,13 @@ class Coordinates():
         if address in self.coordinates:
             return self.coordinates[address]
         else:
-            if self.can_proceed:
-                response, result = returnGeocoderResult(address)
+            if self.can_proceed or address in self.pending:
+                if address in self.pending: # geocoded ahead by .prefetch()
+                    # the future is kept so that repeats of an address that
+                    # got no result are not sent again
+                    response, result = self.pending[address].result()
+                else:
+                    response, result = self.geocode(address)
                 #print(response, result)
                 self.calls += 1
                 if response == False: # returnGeocoderResult returns False when errors reached
@@ -432,17 +953,7 @@ class Coordinates():
                     return None
                 if response == True and result != None: # Either True or False
                     
-                    lat, lng = result.lat, result.lng 
-                    g_address_str = result.formatted_address
-                    city = result.city
-                    house_number = result.street_number
-                    street = result.street
-                    response_tple = address_tpl(g_address_str,
-                            house_number,
-                            street,
-                            city,
-                            lat,
-                            lng)
+                    response_tple = Coordinates.result_tuple(result)
                     self.coordinates[address] = response_tple
                     if all(response_tple):
 
@@ -453,6 +964,102 @@ class Coordinates():
             else:
                 raise Exception('Over_Query_Limit after {} calls'.format(self.calls))
 
+    @staticmethod
+    def result_tuple(result):
+        '''
+        returns the address_tpl of string, house_number, street, city, lat, lng
+        for a GoogleResult
+        '''
+        return address_tpl(result.formatted_address,
+                           result.street_number,
+                           result.street,
+                           result.city,
+                           result.lat,
+                           result.lng)
+
+    def geocode(self, address):
+        '''
+        calls returnGeocoderResult with the backend and rate limiter
+        this runs in the .prefetch() threads, so once one call comes back
+        at the limit the calls still waiting in the queue are skipped
+        '''
+        if not self.can_proceed:
+            return (False, None)
+        response = returnGeocoderResult(address, self.backend, self.bucket)
+        if response[0] is False:
+            self.can_proceed = False
+        return response
+
+    def prefetch(self, addresses, serial=False):
+        '''
+        starts geocoding addresses in the background so that the results
+        are waiting when .lookup() is called for them.  Addresses already
+        coded or queued are skipped
+        with 1 worker nothing is queued unless serial=True, in which case
+        the addresses are geocoded one after the other before this returns
+        returns the number of addresses that were queued
+        '''
+        if self.workers < 2 and not serial:
+            return 0
+        if self.executor is None and self.workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        queued = 0
+        for address in addresses:
+            if not self.can_proceed:
+                break
+            if address and address not in self.coordinates and \
+               address not in self.pending:
+                if self.executor is None:
+                    self.pending[address] = Future()
+                    self.pending[address].set_result(self.geocode(address))
+                else:
+                    self.pending[address] = self.executor.submit(self.geocode,
+                                                                 address)
+                queued += 1
+        return queued
+
+    def drain(self):
+        '''
+        cancels anything still queued by .prefetch(), waits for the calls that
+        were already sent and returns {address: address_tpl} for the ones
+        that came back with a full result but have not been looked up yet.
+        These are paid for, so a Geocode_Checkpoint keeps them for --resume
+        '''
+        for future in self.pending.values():
+            future.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        finished = {}
+        for address, future in self.pending.items():
+            if address in self.coordinates or future.cancelled() or \
+               future.exception() is not None:
+                continue
+            response, result = future.result()
+            if response == True and result != None:
+                response_tple = Coordinates.result_tuple(result)
+                if all(response_tple):
+                    finished[address] = response_tple
+        return finished
+
+    def restore(self, results):
+        '''
+        puts the {address: address_tpl} results from .drain() back so that
+        .lookup() returns them instead of calling the geocoder
+        '''
+        self.coordinates.update(results)
+
+    def close(self):
+        '''
+        cancels anything still queued by .prefetch() and stops the threads
+        '''
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
     def add_coordinates(self, lat, lng):
         '''
         adds a coordinate to the tree structure we are using to store data about the coordinate
@@ -507,19 +1114,38 @@ class SQLdatabase():
     correct address data via a call to the 'google_result' table
     '''
 
-    def __init__(self):
+    def __init__(self, kw=None):
         self.conn = None
         self.cursor = None
         self.name = None
+        # Neighbourhoods used to fill in the neighbourhood table as
+        # coordinates are written.  Without it the table is left alone
+        self.kw = kw
+        self.has_neighbourhoods = False # is there a neighbourhood table?
+        # {(address, city): Coord_package} filled by .preload_coordinates()
+        self.coordinate_cache = {}
+        # {(lat, lng): {(address, city)}} for the cached errors table results
+        # that have no google result yet
+        self.cache_at = defaultdict(set)
         
-    def connect_to(self, name, create = True):
+    def connect_to(self, name, create = True, read_only=False):
         '''
         establish a connection and cursor and if necessary create the address, error
         and google_result tables
+
+        read_only opens the database in sqlite's read only mode and skips
+        creating the tables and migrating the database.  It is used by the
+        worker processes in ops_sort that only look addresses up
         '''
         if name:
             self.name = name
         try:
+            if read_only:
+                self.conn = sqlite3.connect(f'file:{pathname2url(name)}?mode=ro',
+                                            uri=True)
+                self.cursor = self.conn.cursor()
+                self.has_neighbourhoods = self.table_exists('neighbourhood')
+                return
             self.conn = sqlite3.connect(name)
             self.cursor = self.conn.cursor()
             if create:
@@ -552,6 +1178,13 @@ class SQLdatabase():
                                                                          parse_error BOOLEAN,
                                                                          use_google BOOLEAN)""")
                 self.conn.commit()
+                self.cursor.execute("""CREATE TABLE IF NOT EXISTS neighbourhood (lat REAL,
+                                                                                lng REAL,
+                                                                                neighbourhood TEXT,
+                                                                                PRIMARY KEY (lat, lng))""")
+                self.conn.commit()
+            self.has_neighbourhoods = self.table_exists('neighbourhood')
+            migrate(self.conn) # indexes and pragmas
         except KeyboardInterrupt:
             raise
         except:
@@ -568,17 +1201,94 @@ class SQLdatabase():
             return False
         if table == 'address':
             self.cursor.execute('INSERT OR IGNORE INTO address VALUES (?,?,?,?)', values)
+            self.add_neighbourhood(values[2], values[3])
             self.conn.commit()
+            self.coordinate_cache.pop((values[0], values[1]), None)
 
         if table == 'google_result':
             self.cursor.execute("""INSERT OR IGNORE INTO google_result VALUES
                                 (?,?,?,?,?,?,?,?,?,?,?)""", values)
+            self.add_neighbourhood(values[0], values[1])
             self.conn.commit()
+            for key in self.cache_at.pop((values[0], values[1]), ()):
+                self.coordinate_cache.pop(key, None)
 
         if table == 'errors':
             self.cursor.execute('INSERT OR IGNORE INTO errors VALUES (?,?,?,?,?,?,?,?,?,?)', values)
+            self.add_neighbourhood(values[2], values[3])
             self.conn.commit()
+            self.coordinate_cache.pop((values[0], values[1]), None)
         
+    def table_exists(self, table):
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        return self.cursor.fetchone() is not None
+
+    def add_neighbourhood(self, lat, lng):
+        '''
+        works out which neighbourhood lat, lng is in with .kw and puts it in
+        the neighbourhood table if it is not there already.  The caller
+        commits it along with the coordinates
+        '''
+        if self.kw is None or not self.has_neighbourhoods or None in (lat, lng):
+            return
+        self.cursor.execute('SELECT 1 FROM neighbourhood WHERE lat=? AND lng=?', (lat, lng))
+        if self.cursor.fetchone() is None:
+            n_hood = self.kw.find_in_shapes(lat, lng)
+            self.cursor.execute('INSERT INTO neighbourhood VALUES (?,?,?)',
+                                (lat, lng, n_hood or None))
+
+    def fill_neighbourhoods(self, kw=None):
+        '''
+        works out the neighbourhood of every coordinate in the address,
+        errors and google_result tables that is not in the neighbourhood
+        table yet in one go with kw (or .kw)
+        returns the number of coordinates added
+        '''
+        kw = kw or self.kw
+        self.cursor.execute("""SELECT lat, lng FROM address WHERE lat IS NOT NULL AND lng IS NOT NULL
+                               UNION SELECT lat, lng FROM errors WHERE lat IS NOT NULL AND lng IS NOT NULL
+                               UNION SELECT lat, lng FROM google_result WHERE lat IS NOT NULL AND lng IS NOT NULL
+                               EXCEPT SELECT lat, lng FROM neighbourhood""")
+        coordinates = self.cursor.fetchall()
+        n_hoods = kw.find_all_in_shapes(coordinates)
+        self.cursor.executemany('INSERT OR IGNORE INTO neighbourhood VALUES (?,?,?)',
+                                ((lat, lng, n_hood or None) for (lat, lng), n_hood
+                                 in zip(coordinates, n_hoods)))
+        self.conn.commit()
+        return len(coordinates)
+
+    def neighbourhood_at(self, lat, lng):
+        '''
+        returns the name of the neighbourhood stored for lat, lng, False if
+        it is not in one, or None if it has not been worked out
+        '''
+        if not self.has_neighbourhoods:
+            return None
+        self.cursor.execute('SELECT neighbourhood FROM neighbourhood WHERE lat=? AND lng=?', (lat, lng))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row[0] or False
+
+    def neighbourhoods_at(self, coordinates):
+        '''
+        does the work of .neighbourhood_at() for every (lat, lng) in
+        coordinates with one query
+        returns {(lat, lng): name or False} for the ones that have been
+        worked out
+        '''
+        if not self.has_neighbourhoods or not coordinates:
+            return {}
+        self.cursor.execute('DROP TABLE IF EXISTS temp.lookup_coordinates')
+        self.cursor.execute('CREATE TEMP TABLE lookup_coordinates (lat REAL, lng REAL)')
+        self.cursor.executemany('INSERT INTO temp.lookup_coordinates VALUES (?,?)', coordinates)
+        self.cursor.execute("""SELECT n.lat, n.lng, n.neighbourhood
+                               FROM neighbourhood AS n INNER JOIN temp.lookup_coordinates AS c
+                               ON n.lat = c.lat AND n.lng = c.lng""")
+        n_hoods = {(lat, lng): n_hood or False for lat, lng, n_hood in self.cursor.fetchall()}
+        self.cursor.execute('DROP TABLE temp.lookup_coordinates')
+        return n_hoods
+
     def is_in_db(self, parsed_address, source_city):
         '''
         this method checks to see if an address has been logged in the database already.
@@ -630,18 +1340,29 @@ class SQLdatabase():
     def get_coordinates(self, input_address, input_city):
         '''
         searches the address and errors table and google result table and if it finds an entry it returns the lat, lng
-        returns a named tuple with attributes 'lat, lng, source, exists, status, address, city'
+        returns a named tuple with attributes 'lat, lng, source, exists, status, address, city, neighbourhood'
+        neighbourhood is the name from the neighbourhood table, False if the
+        coordinates are not in one or None if it has not been worked out
         if it finds a result in the address table it bounces back teh source address and source city
         if it finds an error, it looks in the google table and pulls out the google result address and city
+        addresses loaded by .preload_coordinates() come out of the cache
         '''
-        Coord_package = namedtuple('Coord_package', 'lat, lng, source, exists, status, address, city')
+        if (input_address, input_city) in self.coordinate_cache:
+            return self.coordinate_cache[(input_address, input_city)]
         result = None
 
-        self.cursor.execute("SELECT lat, lng FROM address WHERE source_street=? AND source_city=?",(input_address, input_city,))
+        if self.has_neighbourhoods: # pick up the neighbourhood in the same query
+            self.cursor.execute("""SELECT a.lat, a.lng, n.lat, n.neighbourhood FROM address AS a
+                                   LEFT JOIN neighbourhood AS n ON n.lat = a.lat AND n.lng = a.lng
+                                   WHERE a.source_street=? AND a.source_city=?""",(input_address, input_city,))
+        else:
+            self.cursor.execute("SELECT lat, lng, NULL, NULL FROM address WHERE source_street=? AND source_city=?",(input_address, input_city,))
         result = self.cursor.fetchone()
               
         if result:
-            return Coord_package(*result, 'address', True, 'valid', input_address, input_city)
+            lt, lg, known, n_hood = result
+            return Coord_package(lt, lg, 'address', True, 'valid', input_address, input_city,
+                                 (n_hood or False) if known is not None else None)
 
         else:
             self.cursor.execute("SELECT lat, lng FROM errors WHERE source_street=? AND source_city=?",(input_address, input_city,))
@@ -654,11 +1375,56 @@ class SQLdatabase():
                     n, s, c = gt_res
                     add = f'{n} {s}' # 'street_number street'
                     cit = f'{c}' # city
-                    return Coord_package(lt, lg, 'errors', True, 'valid', add, cit)
+                    return Coord_package(lt, lg, 'errors', True, 'valid', add, cit,
+                                         self.neighbourhood_at(lt, lg))
                 else:
-                    return Coord_package(*error_result, None, True, 'valid', None, None)
+                    return Coord_package(*error_result, None, True, 'valid', None, None,
+                                         self.neighbourhood_at(lt, lg))
             else:
-                return Coord_package(None, None, None, False, 'no_results', None, None)
+                return Coord_package(None, None, None, False, 'no_results', None, None, None)
+
+    def preload_coordinates(self, keys):
+        '''
+        does the work of .get_coordinates() for every (address, city) in
+        keys with two queries and caches the results so that the calls to
+        .get_coordinates() for those keys do not touch the database.
+        A key is dropped from the cache when a write to the address, errors
+        or google_result table could change its result
+        returns the number of keys that were found in the database
+        '''
+        keys = set(keys)
+        self.cursor.execute('DROP TABLE IF EXISTS temp.lookup_keys')
+        self.cursor.execute('CREATE TEMP TABLE lookup_keys (street TEXT, city TEXT)')
+        self.cursor.executemany('INSERT INTO temp.lookup_keys VALUES (?,?)', keys)
+        found = {}
+        # the first row for each key, the same row .fetchone() returns
+        self.cursor.execute("""SELECT a.source_street, a.source_city, a.lat, a.lng
+                               FROM address AS a INNER JOIN temp.lookup_keys AS k
+                               ON a.source_street = k.street AND a.source_city = k.city
+                               ORDER BY a.rowid""")
+        for street, city, lat, lng in self.cursor.fetchall():
+            if (street, city) not in found:
+                found[(street, city)] = Coord_package(lat, lng, 'address', True, 'valid', street, city, None)
+        self.cursor.execute("""SELECT e.source_street, e.source_city, e.lat, e.lng,
+                               g.lat, g.google_house_num, g.google_street, g.google_city
+                               FROM errors AS e INNER JOIN temp.lookup_keys AS k
+                               ON e.source_street = k.street AND e.source_city = k.city
+                               LEFT JOIN google_result AS g ON g.lat = e.lat AND g.lng = e.lng
+                               ORDER BY e.rowid, g.rowid""")
+        for street, city, lt, lg, g_lat, n, st, c in self.cursor.fetchall():
+            if (street, city) not in found:
+                if g_lat is not None:
+                    found[(street, city)] = Coord_package(lt, lg, 'errors', True, 'valid', f'{n} {st}', f'{c}', None)
+                else:
+                    found[(street, city)] = Coord_package(lt, lg, None, True, 'valid', None, None, None)
+                    self.cache_at[(lt, lg)].add((street, city))
+        self.cursor.execute('DROP TABLE temp.lookup_keys')
+        n_hoods = self.neighbourhoods_at({(x.lat, x.lng) for x in found.values()})
+        for key, package in found.items():
+            found[key] = package._replace(neighbourhood=n_hoods.get((package.lat, package.lng)))
+        for key in keys:
+            self.coordinate_cache[key] = found.get(key, Coord_package(None, None, None, False, 'no_results', None, None, None))
+        return len(found)
 
     def in_google_tab(self, lat, lng):
         self.cursor.execute("SELECT lat, lng FROM google_result WHERE lat=? AND lng=?", ((lat, lng,)))
@@ -698,7 +1464,8 @@ class SQLdatabase():
         this will allow us to identify partial addresses to follow up on
         returns: boolean values in a 4 named tuple (valid, errors, unit_flag, dir_flag, post_type)
         '''
-        Flag_pack = namedtuple('Flag_pack', 'valid, error_free, unit_flag, dir_flag, post_type')
+        if lat is None or lng is None: # nothing is stored at NULL
+            return Flag_pack(False, None, False, False, False)
         self.cursor.execute(f"SELECT unit_flag, dir_flag, post_type FROM {table} WHERE lat=? AND lng =?",(lat,lng,))
         flag_query = self.cursor.fetchone()
         if flag_query:
@@ -727,6 +1494,92 @@ class SQLdatabase():
         '''
         self.conn.close()
 
+class Geocode_Checkpoint():
+    '''
+    keeps track of how far the geocoder got through a source file in the
+    checkpoint table of the address database so that a run that hit the api
+    wall (or was stopped) can be picked up with --resume
+
+    the checkpoint is the sha1 of the file and the offset of the first line
+    that has not been processed.  It is saved after every line, in step with
+    the writes to the other tables.  The geocoding results that were already
+    back from the prefetch threads when the run stopped are kept in
+    checkpoint_results until the next run of the same file
+
+    param dbase is a connected SQLdatabase
+    param path is the source file
+    '''
+    def __init__(self, dbase, path):
+        self.conn = dbase.conn
+        self.path = path
+        self.file_hash = file_hash(path)
+        self.lines_done = 0
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS checkpoint (source_file TEXT PRIMARY KEY,
+                                                                   file_hash TEXT,
+                                                                   line_offset INTEGER,
+                                                                   lines_done INTEGER,
+                                                                   updated timestamp)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS checkpoint_results (source_file TEXT,
+                                                                           api_address TEXT,
+                                                                           g_address_str TEXT,
+                                                                           house_number TEXT,
+                                                                           street TEXT,
+                                                                           city TEXT,
+                                                                           lat REAL,
+                                                                           lng REAL,
+                                                                           PRIMARY KEY (source_file, api_address))""")
+        self.conn.commit()
+
+    def resume_from(self):
+        '''
+        returns (offset, results) where offset is the first unprocessed line
+        of the file and results are the {api address: address_tpl} kept from
+        the interrupted run
+        returns (None, {}) if there is no checkpoint or the file has changed
+        since it was saved
+        '''
+        row = self.conn.execute("""SELECT file_hash, line_offset, lines_done
+                                   FROM checkpoint WHERE source_file = ?""",
+                                (self.path,)).fetchone()
+        if row is None:
+            print(f'no checkpoint for {self.path}. starting at the top')
+            return None, {}
+        saved_hash, offset, lines_done = row
+        if saved_hash != self.file_hash:
+            print(f'{self.path} has changed since the checkpoint. starting at the top')
+            return None, {}
+        self.lines_done = lines_done
+        results = {x[0]: address_tpl(*x[1:]) for x in self.conn.execute(
+                   """SELECT api_address, g_address_str, house_number, street,
+                      city, lat, lng FROM checkpoint_results
+                      WHERE source_file = ?""", (self.path,))}
+        print(f'resuming {self.path} after line {lines_done} with {len(results)} geocoding results kept')
+        return offset, results
+
+    def line_done(self, offset):
+        '''
+        records that the lines up to offset have been processed
+        '''
+        self.lines_done += 1
+        self.conn.execute('INSERT OR REPLACE INTO checkpoint VALUES (?,?,?,?,?)',
+                          (self.path, self.file_hash, offset, self.lines_done,
+                           strftime('%Y-%m-%d %H:%M:%S', gmtime())))
+        self.conn.commit()
+
+    def keep_results(self, results):
+        '''
+        replaces the kept geocoding results for the file with results
+        which is {api address: address_tpl} from Coordinates.drain()
+        returns the number kept
+        '''
+        self.conn.execute('DELETE FROM checkpoint_results WHERE source_file = ?',
+                          (self.path,))
+        self.conn.executemany('INSERT INTO checkpoint_results VALUES (?,?,?,?,?,?,?,?)',
+                              ((self.path, address, *result)
+                               for address, result in results.items()))
+        self.conn.commit()
+        return len(results)
+
 class Source_Address():
     '''
     Aggregate the flags and methods related to parsing address strings,
@@ -767,7 +1620,8 @@ class Source_Address():
         
         try:
             self.simplified_address, self.flags = self.decon_address
-            # flags = {'MultiUnit': False, 'Direction': False, 'PostType': False}   
+            # flags = {'MultiUnit': False, 'Direction': False, 'PostType': False,
+            #          'PostTypes': source_post_types()}
         except KeyboardInterrupt:
             raise
         except:
@@ -778,7 +1632,8 @@ class Source_Address():
             self.error_dictionary['boundary_error'] = True
         if self.decon_address is not False and self.in_bounds == True:
             self.flagged_unit = self.flags['MultiUnit'] # True or False if it is a multi unit building
-            self.source_post_types = parse_post_types(self.simplified_address)
+            # worked out from the same usaddress tags as the simplified address
+            self.source_post_types = self.flags['PostTypes']
             # ((streetnameptype, street_key), (streetnamepdir, dir_key), eval_flag)
             _, _, self.s_evf = self.source_post_types
             # is there a mismatch in the pt (st, dr etc) or dir (N,S,E,W) keys?  
@@ -835,8 +1690,6 @@ class Database_View():
         else returns tuple (lat, lng, source_table) 
         or False if no results
         '''
-        Fail_package = namedtuple('Coord_package', 'lat, lng, source, exists, status, address, city')
-
         try: # look for database result
             dbr = self.db.get_coordinates(address, city)
             # a named tuple
@@ -851,7 +1704,7 @@ class Database_View():
         except KeyboardInterrupt:
             raise
         except:
-            return Fail_package(None, None, None, False, 'failed', None, None)
+            return Coord_package(None, None, None, False, 'failed', None, None, None)
     
     def google_tab_entry(self, lat, lng):
         return self.db.in_google_tab(lat, lng) # T | F
@@ -898,12 +1751,19 @@ class Geocode_View():
         self.input_address = input_a
         self.input_city = input_c
         self.c_m = c_m
-        self.address_for_api = f'{input_a} {input_c} Ontario, Canada'
+        self.address_for_api = Geocode_View.api_address(input_a, input_c)
         self.coding_result = None # named tuple 'g_address_str,house_number,street,city,lat,lng'
         self.lat = None
         self.lng = None
         self.flags = {'at_limit': False, 'no_result': False, 'no_errors': False, 'gc_failed': True} 
 
+    @staticmethod
+    def api_address(address, city):
+        '''
+        returns the string that is sent to the geocoder for address, city
+        '''
+        return f'{address} {city} Ontario, Canada'
+
     def gc_address(self):
         '''
         try and geocode the address
@@ -940,7 +1800,6 @@ class Geocode_View():
         '''
         returns a package of values that can be used to make decisions
         '''
-        Package = namedtuple('Package', 'status, lat, lng')
         if self.flags.get('no_errors', False):
             return Package('no_errors', self.lat, self.lng)
         if self.flags.get('at_limit', False):
@@ -974,7 +1833,11 @@ class line_obj_parser():
     
     '''    
     def __init__(self, line, fnamedict, dbase, co_d_m):
-        self.line_object = Visit_Line_Object(line, fnamedict)
+        # only the address, city and applicant are needed from the line
+        self.line_object = Visit_Line_Object(line, fnamedict,
+                                             fields=('visit_Address',
+                                                     'visit_City',
+                                                     'main_applicant_ID'))
         self.flags = {} # aggregate the error flags through each processing step
         self.flagged_unit = False # delete after calling to self.SAO.flagged_unit
         self.coordinate_man = co_d_m
@@ -1070,6 +1933,20 @@ class line_obj_parser():
             self.can_proceed_to_gc = True
             return False          
 
+    def prefetch_address(self):
+        '''
+        returns the string .try_gc_api() will send to the geocoder if
+        this line looks like it will need geocoding (it deconstructed
+        cleanly and the address is not in the database) or None
+        used to queue up geocoding before the line is processed
+        '''
+        if self.can_proceed_to_gc and (self.simplified_address != None):
+            if not self.DBV.in_db(self.simplified_address, self.city,
+                                  bool_flag=True):
+                return Geocode_View.api_address(self.simplified_address,
+                                                self.city)
+        return None
+
     def try_gc_api(self):
         '''
         if the .can_proceed_to_gc value has been set
@@ -1137,7 +2014,6 @@ class line_obj_parser():
                 self.google_post_types = parse_post_types(self.google_h_street) # GOOGLE PT
                 self.pt_eval_errors = evaluate_post_types(self.SAO.source_post_types, self.google_post_types)
             else:
-                null_tuple = namedtuple('null_tuple', 'status, error_free, sn_error, dt_error, fl_error')
                 self.pt_eval_errors = null_tuple('null', False, False, False, False)
 
         # SET FLAGS TO GUIDE DB WRITE LOGIC
@@ -1313,48 +2189,19 @@ class line_obj_parser():
                 s4_1 = f'4,{who},{where},has,{e} error(s),City mismatch,{c_com != True },Missing Unit Number,{dat_b.unit_flag},Direction Error,{dat_b.dir_flag or goo_p.dt_error},Street Type Error,{dat_b.post_type or goo_p.sn_error}'
                 meta_log.info(s4_1) 
                 errors_log.info(s4_1)
-        # SPECIAL CASES
-        if self.flags.get('at_limit', False):
-            meta_log.info(f'X,{who},at,{where},hit the google api wall')
-            sys.exit(0)
-            stop_now = input('API limit reached.  Continue "y" or "n"  ')
-            if not stop_now.lower()[0] == 'y': 
-                sys.exit(0)
-            else:
-                print('ok then... continuing...')
 
-if __name__ == '__main__':
-    
-    
-
-    
-    # MENU INPUT
-    menu = Menu(base_path='sources/' )
-    menu.get_file_list()
-    s_target = menu.handle_input(menu.prompt_input('files'))
-
-    confirm = input(f''''1. Use default {t_file}\n2. Use choice {s_target}\n3. Exit\n ''')
-
-    if str(confirm) == '1':
-        print(f'using: {confirm}') 
-    elif str(confirm) == '2':
-        t_file = s_target
-        print(f'using: {t_file}')
-    else:
-        print(f'exiting. Input was: {confirm}')
-        sys.exit(0)
+class At_Api_Limit(Exception):
+    '''
+    raised by process_lines() when geocoding stops at the api limit
+    '''
 
-    # SETUP CLASSES AND CONFIG
-    coordinate_manager = Coordinates() # I lookup and manage coordinate data
-    address_parser = AddressParser() # I strip out extraneous junk from address strings
-    dbase = SQLdatabase() # I recieve the geocoded information from parsed address strings
-    dbase.connect_to(add_base, create=True) # testing = atest.db
-    fnames = Field_Names(t_file) # I am header names
-    fnames.init_index_dict() 
-    export_file = Export_File_Parser(t_file, fnames) # I open a csv 
-    export_file.open_file()
-    # ITERATE THROUGH THE INPUT FILE LINE BY LINE
-    for line in export_file: # I am a csv object
+def deconstruct_lines(lines, fnames, dbase, coordinate_manager, address_parser):
+    '''
+    sets up a line_obj_parser for each line and deconstructs its address
+    returns a list of (line_obj_parser, error_stack) in the order of lines
+    '''
+    lops = []
+    for line in lines:
         error_stack = {'d_parse': False, 'dbase_write': False}
         # the lop controls the address parsing pipeline
         lop = line_obj_parser(line, fnames.ID, dbase, coordinate_manager) #.ID 
@@ -1366,9 +2213,24 @@ if __name__ == '__main__':
         except:
             meta_log.info('could not successfully call deconstruct method')
             error_stack['d_parse'] = True  
-        
+        lops.append((lop, error_stack))
+    return lops
+
+def process_lines(lops, done=None):
+    '''
+    polls the db, geocodes if needed, diffs, writes and logs each of the
+    deconstructed lines from deconstruct_lines() in order
+    done is called with the index of each line once it has been written
+
+    raises At_Api_Limit at the first line that hits the google api wall.
+    Nothing is written for that line so it is where a --resume run starts
+    '''
+    for n, (lop, error_stack) in enumerate(lops):
         if not lop.poll_db(): # poll db - for results
             lop.try_gc_api() # attempt to geocode if needed
+            if lop.flags.get('at_limit', False):
+                meta_log.info(f'X,{lop.line_object.main_applicant_ID},at,{lop.address} {lop.city},hit the google api wall')
+                raise At_Api_Limit(f'{lop.address} {lop.city} hit the google api wall')
         lop.diff_results() # compare source + db as well as source + google - set error flags
         
         try:
@@ -1383,6 +2245,118 @@ if __name__ == '__main__':
 
         lop.log_results(error_stack)
         meta_log.info('############')
+        if done:
+            done(n)
+
+if __name__ == '__main__':
+    
+    cli = argparse.ArgumentParser(description='geocode the addresses in an export file')
+    cli.add_argument('--workers', type=int, default=GEOCODE_WORKERS,
+                     help='threads geocoding ahead of the line being processed (1 turns it off)')
+    cli.add_argument('--rate', type=float, default=GEOCODE_RATE,
+                     help='geocoding requests per second')
+    cli.add_argument('--chunk', type=int, default=GEOCODE_CHUNK,
+                     help='lines read ahead of the line being processed')
+    cli.add_argument('--dedupe', action='store_true',
+                     help='read the whole file first and look up and geocode each unique address once')
+    cli.add_argument('--resume', action='store_true',
+                     help='pick up from the checkpoint left by a run of the same file that stopped early')
+    cli.add_argument('--neighbourhoods', action='store_true',
+                     help='work out the neighbourhoods of the coordinates already in the address database and exit')
+    args = cli.parse_args()
+
+    k_w = Neighbourhoods(NEIGHBOURHOOD_SHAPES)
+    k_w.extract_shapes() # get shapes ready to test points
+    if args.neighbourhoods:
+        dbase = SQLdatabase(kw=k_w)
+        dbase.connect_to(add_base, create=True)
+        print(f'added neighbourhoods for {dbase.fill_neighbourhoods()} coordinates to {add_base}')
+        dbase.close_db()
+        sys.exit(0)
+
+    
+    # MENU INPUT
+    menu = Menu(base_path='sources/' )
+    menu.get_file_list()
+    s_target = menu.handle_input(menu.prompt_input('files'))
+
+    confirm = input(f''''1. Use default {t_file}\n2. Use choice {s_target}\n3. Exit\n ''')
 
+    if str(confirm) == '1':
+        print(f'using: {confirm}') 
+    elif str(confirm) == '2':
+        t_file = s_target
+        print(f'using: {t_file}')
+    else:
+        print(f'exiting. Input was: {confirm}')
+        sys.exit(0)
+
+    # SETUP CLASSES AND CONFIG
+    # I lookup and manage coordinate data
+    coordinate_manager = Coordinates(workers=args.workers,
+                                     bucket=Token_Bucket(args.rate))
+    # I strip out extraneous junk from address strings
+    address_parser = AddressParser(store=parse_store_for(add_base))
+    dbase = SQLdatabase(kw=k_w) # I recieve the geocoded information from parsed address strings
+    dbase.connect_to(add_base, create=True) # testing = atest.db
+    fnames = Field_Names(t_file) # I am header names
+    fnames.init_index_dict() 
+    export_file = Export_File_Parser(t_file, fnames) # I open a csv 
+    # I remember how far through the file we got
+    checkpoint = Geocode_Checkpoint(dbase, t_file)
+    start, kept = checkpoint.resume_from() if args.resume else (None, {})
+    coordinate_manager.restore(kept)
+    export_lines = export_file.lines_from(start) # (line, offset of the next line)
+    # ITERATE THROUGH THE INPUT FILE A CHUNK OF LINES AT A TIME
+    # each chunk is deconstructed first so that the addresses that are not
+    # in the database can be sent to the geocoding threads.  Then the
+    # lines are polled, diffed, written and logged one by one in the order
+    # of the file, picking up the geocoding results as they go
+    # with --dedupe the whole file is one chunk and the unique addresses in
+    # it are looked up in the database in one go before anything is coded
+    if args.dedupe:
+        batches = [list(export_lines)]
+    else:
+        batches = chunks(export_lines, args.chunk)
+    at_limit = False
+    try:
+        for batch in batches:
+            lines = [line for line, _ in batch]
+            offsets = [offset for _, offset in batch]
+            lops = deconstruct_lines(lines, fnames, dbase, coordinate_manager,
+                                     address_parser)
+            if args.dedupe:
+                keys = {(lop.simplified_address, lop.city) for lop, _ in lops
+                        if lop.can_proceed_to_gc and lop.simplified_address != None}
+                in_db = dbase.preload_coordinates(keys)
+                print(f'{len(lops)} lines have {len(keys)} unique addresses. {in_db} are in the database')
+            # with one worker --dedupe geocodes the misses here one by one
+            queued = coordinate_manager.prefetch((lop.prefetch_address() for lop, _ in lops),
+                                                 serial=args.dedupe)
+            if args.dedupe:
+                print(f'geocoding {queued} addresses')
+            process_lines(lops, done=lambda n: checkpoint.line_done(offsets[n]))
+    except At_Api_Limit as wall:
+        # everything up to the line at the wall is in the database and the
+        # checkpoint points at that line.  Keep what has been coded so far,
+        # including the calls that were in flight, for the --resume run
+        at_limit = True
+        kept = coordinate_manager.drain()
+        kept.update(coordinate_manager.coordinates)
+        print(f'{wall} after line {checkpoint.lines_done}. kept {checkpoint.keep_results(kept)} geocoding results')
+    finally:
+        coordinate_manager.close()
+    if not at_limit:
+        checkpoint.keep_results({})
+
+    parse_stats = address_parser.cache_stats()
+    meta_log.info(f'address parse cache {parse_stats}')
+    meta_log.info(f'normalizer caches {normalizer_stats()}')
+    address_parser.close()
     dbase.close_db()
-    print(f'proccess complete on source file {t_file}')
+    if at_limit:
+        print(f'stopped at the api limit. run again with --resume to carry on with {t_file}')
+    else:
+        print(f'proccess complete on source file {t_file}')
+    fast = parse_stats['fast_path']
+    print(f'{fast["fast"]} of {fast["fast"] + fast["crf"]} addresses were tagged by the fast path ({fast["hit_rate"]:.1%})')
@@ -18,13 +18,19 @@ household, family member and route data in a SQLite3 database
 from collections import namedtuple
 from collections import defaultdict
 from collections import Counter
-from math import radians, cos, sin, asin, sqrt
+from math import radians, cos, sin, asin, sqrt, floor
 from operator import attrgetter
+from contextlib import contextmanager
+import heapq
+import timeit
+import numpy as np
 import csv
 import sqlite3
 import logging
 import datetime
 
+from db_migrations import migrate
+
 logging.basicConfig(filename='Logging/route_sorting.log',level=logging.INFO)
 logging.info('Running new session {}'.format(datetime.datetime.now()))
 
@@ -38,6 +44,7 @@ sort_log.info('Running new session: {}'.format(datetime.datetime.now()))
 
 Client = namedtuple('Client', 'size location')
 Geolocation = namedtuple('Geolocation', 'lat long')
+hh_pack = namedtuple('hh_pack', 'applicant, letter, size, street')
 
 BOX_MASK = {'0' : 1, 
             '1' : 1, 
@@ -59,14 +66,16 @@ BOX_MASK = {'0' : 1,
             '17':1, 
             '18':1 }
 
+SORT_ENGINES = ('grid', 'brute') # engines Delivery_Routes.sort_with() knows
+
 def haversine(lon1, lat1, lon2, lat2):
     """
     Calculate the great circle distance between two points 
     on the earth (specified in decimal degrees)
     Thanks Stack Overflow!
 
-    This function is called in the sort_method() of the Delivery_Routes() 
-    class 
+    The sort methods of the Delivery_Routes() class use haversine_array()
+    which does the same math on numpy arrays
 
     """
     # convert decimal degrees to radians 
@@ -79,6 +88,74 @@ def haversine(lon1, lat1, lon2, lat2):
     km = 6367 * c
     return km
 
+def haversine_array(lon1, lat1, lon2, lat2):
+    '''
+    The haversine() formula done with numpy so that a whole batch of
+    distances is calculated in one call.  Any of the parameters can be a
+    float or an array and they are broadcast against each other, so
+
+    haversine_array(lng, lat, lngs, lats) gives a vector of the distances
+    from one household to many (one-to-many)
+
+    returns a numpy array of distances in km
+    '''
+    lon1, lat1, lon2, lat2 = map(np.radians, (np.asarray(lon1, dtype=float),
+                                              np.asarray(lat1, dtype=float),
+                                              np.asarray(lon2, dtype=float),
+                                              np.asarray(lat2, dtype=float)))
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return 6367 * 2 * np.arcsin(np.sqrt(a))
+
+def haversine_matrix(lons1, lats1, lons2, lats2):
+    '''
+    many-to-many version of haversine_array()
+    returns a len(lons1) x len(lons2) array where [i][j] is the distance in
+    km between point i of the first set and point j of the second
+    '''
+    return haversine_array(np.asarray(lons1, dtype=float)[:, None],
+                           np.asarray(lats1, dtype=float)[:, None],
+                           np.asarray(lons2, dtype=float)[None, :],
+                           np.asarray(lats2, dtype=float)[None, :])
+
+def nearest_unassigned(lat, lng, fids, lats, lngs, boxes_left, box_size,
+                       smallest_box=1):
+    '''
+    picks the households closest to lat, lng that will fit in a route that
+    has boxes_left boxes to spare.
+
+    fids = file ids of the households that are free to be picked
+    lats, lngs = their coordinates in the same order as fids
+    box_size = a function that takes a file id and returns how many boxes
+    that household needs
+    smallest_box = the fewest boxes any household can need.  Picking stops
+    when there is less room than that left in the route
+
+    Households are taken closest first.  One that needs more boxes than are
+    left is skipped and the next closest is tried.  Households at the same
+    distance are taken in the order they appear in fids.  The distances go
+    into a heap so that only the households that are looked at get sorted.
+
+    returns a list of the picked file ids, closest first
+    '''
+    distances = haversine_array(lng, lat, lngs, lats).tolist()
+    heap = list(zip(distances, range(len(distances))))
+    heapq.heapify(heap)
+    picked = []
+    taken = set()
+    while heap and boxes_left >= smallest_box:
+        _, position = heapq.heappop(heap)
+        fid = fids[position]
+        if fid in taken:
+            continue
+        boxes = box_size(fid)
+        if boxes <= boxes_left:
+            boxes_left -= boxes
+            picked.append(fid)
+            taken.add(fid)
+    return picked
+
 
 class Route_Summary():
     '''
@@ -98,6 +175,8 @@ class Route_Summary():
     of a route is helpful for preparation and distribution
 
     '''
+    __slots__ = ('route', 'streets', 'neighbourhood', 'applicant_list',
+                 'sizes', 'letter_map', 'boxes', 'letters', 'street_list')
 
     def __init__(self, rn):
         self.route = rn # route number
@@ -115,8 +194,6 @@ class Route_Summary():
                               # | streets | household info |
     
     def get_service_dict(self):
-        hh_pack = namedtuple('hh_pack', 'applicant, letter, size, street')
-
         dict_package = {f[1] : hh_pack(*f) for f in zip(self.applicant_list, 
                                               self.letters, 
                                               self.sizes,
@@ -159,6 +236,8 @@ class Route_Database():
     4. 'sponsor' = file id for main applicant, food_sponsor, gift_sponsor
     5. 'gift_table' = file_id for main applicant, sa_app_num
     6. 'pickup_table'
+    7. 'line_hashes' = file id for main applicant and a hash of their lines
+    in the export the last time they were sorted
     It is the central database that will recieve routes, reproduce them
     and return route specific information when needed by other classes
     and methods
@@ -171,6 +250,12 @@ class Route_Database():
         self.conn = None
         self.cur = None
         self.summary_array = {} # where we will stash summary objects
+        self.routed_ids = set() # file ids in the 'routes' table
+        self.batching = False # True inside a .batch() block
+        # file ids of households that have been edited since their rows
+        # were written.  Set by ops_sort --incremental so that they are
+        # written again with .replace_household()
+        self.edited_ids = set()
         if self.path_name:
             self.conn = sqlite3.connect(path_name)
             self.cur = self.conn.cursor()
@@ -207,6 +292,111 @@ class Route_Database():
                              (file_id INT NOT NULL UNIQUE, pu_zone TEXT, pu_num
                              INT, message_sent INT)''')
             self.conn.commit()
+            # LINE HASHES
+            self.cur.execute('''CREATE TABLE IF NOT EXISTS line_hashes
+                             (file_id INT NOT NULL UNIQUE, line_hash TEXT,
+                             sorting_date timestamp)''')
+            self.conn.commit()
+            migrate(self.conn) # indexes and pragmas
+            self.load_routed_ids()
+
+    @staticmethod
+    def route_key(file_id):
+        '''
+        the routes table stores file ids as INT so '123' and 123 are the
+        same household to the database.  This returns the int version
+        where there is one so the .routed_ids set agrees with the table
+        '''
+        try:
+            return int(file_id)
+        except (TypeError, ValueError):
+            return file_id
+
+    def load_routed_ids(self):
+        '''
+        pulls every file id out of the 'routes' table in one query and
+        stores them in the .routed_ids set so that prev_routed() can be
+        answered without going back to the database.
+        add_route() keeps the set up to date after this
+        '''
+        self.cur.execute("SELECT file_id FROM routes")
+        self.routed_ids = {self.route_key(x[0]) for x in self.cur.fetchall()}
+
+    def commit(self):
+        '''
+        commits the last write unless we are inside a .batch() block, in
+        which case the commit happens once when the block ends
+        '''
+        if not self.batching:
+            self.conn.commit()
+
+    @contextmanager
+    def batch(self):
+        '''
+        a context manager that holds back the commit after each row written
+        by the add_ methods and commits once at the end of the block
+
+        with route_database.batch():
+            for house in households:
+                route_database.add_route(...)
+
+        rows written before an exception are still committed, the same as
+        they would be if each one had been committed as it was written
+        '''
+        self.batching = True
+        try:
+            yield self
+        finally:
+            self.batching = False
+            self.conn.commit()
+
+    def add_family_members_bulk(self, app_id, people):
+        '''
+        adds the family members of one main applicant to the 'family' table
+        with one executemany and one commit.  people are tuples made by
+        Person.get_base_profile() the same as add_family_member() takes
+        '''
+        rows = [(app_id, p[0], p[1], p[2], p[3], p[4]) for p in people]
+        self.cur.executemany("INSERT OR IGNORE INTO family VALUES (?,?,?,?,?,?)",
+                             rows)
+        self.commit()
+
+    def replace_household(self, family_tple, people):
+        '''
+        writes a household over its row in the 'applicants' table and
+        replaces its family members in the 'family' table with people.
+        family_tple and people are the same as add_family() and
+        add_family_members_bulk() take
+        '''
+        app_id = family_tple[0]
+        self.cur.execute("INSERT OR REPLACE INTO applicants VALUES\
+                         (?,?,?,?,?,?,?,?,?,?,?,?,?)", family_tple)
+        self.cur.execute("DELETE FROM family WHERE main_applicant=?", (app_id,))
+        rows = [(app_id, p[0], p[1], p[2], p[3], p[4]) for p in people]
+        self.cur.executemany("INSERT OR REPLACE INTO family VALUES (?,?,?,?,?,?)",
+                             rows)
+        self.commit()
+        self.edited_ids.discard(self.route_key(app_id))
+
+    def add_line_hashes_bulk(self, hashes):
+        '''
+        records the hash of the export lines of each household that has been
+        sorted into the database, replacing the hash from an earlier run
+        hashes = iterable of (file_id, line_hash) tuples
+        '''
+        dt = datetime.date.today()
+        rows = [(fid, l_hash, dt) for fid, l_hash in hashes]
+        self.cur.executemany("INSERT OR REPLACE INTO line_hashes VALUES (?, ?, ?)",
+                             rows)
+        self.commit()
+
+    def load_line_hashes(self):
+        '''
+        returns a dictionary of {file_id: line_hash} from the 'line_hashes'
+        table with the file ids made by .route_key()
+        '''
+        self.cur.execute("SELECT file_id, line_hash FROM line_hashes")
+        return {self.route_key(fid): l_hash for fid, l_hash in self.cur.fetchall()}
 
     def add_route(self, file_id, rn, rl):
         '''
@@ -221,7 +411,8 @@ class Route_Database():
         dt = datetime.date.today()
         db_tple = (file_id, rn, rl, dt, 0)
         self.cur.execute("INSERT OR IGNORE INTO routes VALUES (?, ?, ?, ?, ?)", db_tple)
-        self.conn.commit()  
+        self.commit()  
+        self.routed_ids.add(self.route_key(file_id))
 
     def add_sponsor(self, file_id, food_sponsor, gift_sponsor,\
                     voucher_sponsor, turkey_sponsor,\
@@ -244,14 +435,14 @@ class Route_Database():
         if not any(new): # service providers
             self.cur.execute("INSERT OR IGNORE INTO sponsor VALUES (?, ?, ?, ?, ?, ?)",\
                              db_tple)
-            self.conn.commit()
+            self.commit()
         elif any(new):
             new_tple = (food_sponsor, gift_sponsor, voucher_sponsor,
                         turkey_sponsor, file_id)
             self.cur.execute("""UPDATE sponsor SET food_sponsor=?, gift_sponsor=?,
                              voucher_sponsor=?, turkey_sponsor=? WHERE
                              file_id=?""", new_tple)
-            self.conn.commit()
+            self.commit()
     
     def add_sa_appointment(self, file_id, app_num, provider):
         '''
@@ -268,7 +459,7 @@ class Route_Database():
             db_tple = (file_id, app_num, provider, 0)
             self.cur.execute("INSERT INTO gift_table VALUES (?, ?, ?, ?)",
                          db_tple)
-            self.conn.commit()
+            self.commit()
             return (False, None)
         except Exception as sqlerror:
             return (True, sqlerror)
@@ -277,7 +468,7 @@ class Route_Database():
         try:
             db_tple_1 = (file_id, pu_zone, pu_num, 0)
             self.cur.execute('INSERT INTO pickup_table VALUES (?, ?, ?, ?)',db_tple_1)
-            self.conn.commit()
+            self.commit()
             return (False, None)
         except Exception as sqlerror:
             return (True, sqlerror)
@@ -293,7 +484,7 @@ class Route_Database():
         self.cur.execute("INSERT OR IGNORE INTO applicants VALUES\
                          (?,?,?,?,?,?,?,?,?,?,?,?,?)",\
                          family_tple)
-        self.conn.commit()
+        self.commit()
 
     def add_family_member(self, app_id, person):
         '''
@@ -309,14 +500,19 @@ class Route_Database():
                       person[4])
         self.cur.execute("INSERT OR IGNORE INTO family VALUES (?,?,?,?,?,?)",
                          six_tuple)
-        self.conn.commit()
+        self.commit()
 
 
-    def prev_routed(self, applicant):
+    def prev_routed(self, applicant, from_set=False):
         '''
         double checks to see if this household has been routed
         before by looking for a file id in the 'routes' table
+
+        if from_set is True the .routed_ids set is checked instead
+        of running a query
         '''
+        if from_set:
+            return self.route_key(applicant) in self.routed_ids
 
         self.cur.execute("SELECT * FROM routes WHERE file_id=?", (applicant,))
         if self.cur.fetchone():
@@ -464,7 +660,16 @@ class Delivery_Household():
     the summary parameter which is a named tupled created by the
     Visit_Line_Object class get_HH_summary() method
 
+    There is one of these for every household in the route database so it
+    uses __slots__ to keep them small
+
     '''
+    __slots__ = ('main_app_ID', 'household_ID', 'hh_size', 'geo_tuple',
+                 'route_number', 'route_letter', 'neighbourhood', 'postal',
+                 'summary', 'family_members', 'sa_app_num', 'food_sponsor',
+                 'gift_sponsor', 'voucher_sponsor', 'turkey_sponsor',
+                 'sa_time', 'hof_pu_zone', 'hof_pu_num', 'hof_pu_time',
+                 'hof_pu_date', 'item_req', 'food_req')
 
     def __init__(self, file_id, hh_id, family_size, lat, lng, summary, hood,
                  postal=None, rn=None, rl=None, null_geo=False):
@@ -778,12 +983,14 @@ class Delivery_Household_Collection():
         '''
         return self.hh_dict[fid].routed()
 
-    def has_been_routed_in_db(self, fid, database):
+    def has_been_routed_in_db(self, fid, database, from_set=False):
         '''
         takes a Route_Database object and calls
         a method to see if the hh has been previously entered as a route
+        from_set = check the set of routed file ids that the Route_Database
+        holds rather than querying the table
         '''
-        return database.prev_routed(fid)
+        return database.prev_routed(fid, from_set=from_set)
 
     def setup_rt_summary(self, rn):
         '''
@@ -849,6 +1056,19 @@ class Delivery_Household_Collection():
         '''
         return self.hh_dict[fid].hh_size
 
+    def geo_arrays(self, fids=None):
+        '''
+        returns a (lats, lngs) tuple of numpy arrays for the households in
+        fids (or the .delivery_targets if fids is not given) in the same
+        order as fids.  These can be handed straight to haversine_array()
+        or haversine_matrix()
+        '''
+        if fids is None:
+            fids = self.delivery_targets
+        geo = np.array([self.hh_dict[f].geo_tuple for f in fids],
+                       dtype=float).reshape(-1, 2)
+        return geo[:, 0], geo[:, 1]
+
     def get_summary(self, fid):
         '''
         gets the summary data needed to print a delivery card
@@ -971,6 +1191,149 @@ class Delivery_Household_Collection():
     def __str__(self):
         return f'{self.hh_dict.keys()}'
 
+class Household_Grid():
+    '''
+    A grid bucket index over the geo_tuples of delivery households so that
+    a route can be built by asking for the nearest households around a
+    starting point instead of measuring the distance to every household
+    in the collection.
+
+    The map is cut into square cells of cell_size decimal degrees and each
+    household is dropped into the cell its lat, lng falls in.  The
+    .nearest() method walks outwards from the cell of the starting point one
+    ring of cells at a time and yields households in order of distance.
+    A household is only yielded once every cell that could hold something
+    closer has been looked at, so the order is the same as sorting all of
+    the distances.  Households at the same distance come out in the order
+    they were inserted.
+
+    entries are keyed to an order number (their position in the
+    Delivery_Household_Collection.delivery_targets list) rather than file id
+    so that duplicate file ids behave the same way they do in the brute
+    force sort_method()
+    '''
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size # width of a cell in decimal degrees
+        self.cells = defaultdict(dict) # (row, col): {order: (fid, lat, lng)}
+        self.positions = {} # order: (row, col)
+        self.min_cos = 1.0 # smallest cos(lat) in the grid
+        self.bounds = None # (min row, max row, min col, max col)
+
+    def cell_of(self, lat, lng):
+        return (floor(lat / self.cell_size), floor(lng / self.cell_size))
+
+    def insert(self, order, fid, lat, lng):
+        '''
+        drops a household into the cell that contains lat, lng
+        '''
+        row, col = self.cell_of(lat, lng)
+        self.cells[(row, col)][order] = (fid, lat, lng)
+        self.positions[order] = (row, col)
+        self.min_cos = min(self.min_cos, cos(radians(abs(lat))))
+        if self.bounds:
+            r_min, r_max, c_min, c_max = self.bounds
+            self.bounds = (min(r_min, row), max(r_max, row),
+                           min(c_min, col), max(c_max, col))
+        else:
+            self.bounds = (row, row, col, col)
+
+    def remove(self, order):
+        '''
+        takes a household out of the grid.  It is safe to call this on
+        an order number that is not in the grid
+        '''
+        cell = self.positions.pop(order, None)
+        if cell:
+            del self.cells[cell][order]
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def ring_cells(self, row, col, ring):
+        '''
+        yields the cells that are exactly ring cells away from row, col
+        '''
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
+    def ring_floor(self, ring):
+        '''
+        returns a distance in km that every household ring or more cells
+        away from the starting cell is guaranteed to be beyond.
+        a household that far out is at least (ring - 1) cells away in
+        latitude or in longitude and the haversine distance can be no
+        shorter than either of those offsets.  The longitude offset is
+        scaled by the smallest cos(lat) in the grid.
+        '''
+        span = radians((ring - 1) * self.cell_size)
+        if span <= 0:
+            return 0.0
+        lat_km = 6367 * span
+        lng_km = 2 * 6367 * asin(self.min_cos * sin(min(span, 3.14) / 2))
+        return min(lat_km, lng_km) * (1 - 1e-9)
+
+    def nearest(self, lat, lng):
+        '''
+        yields (distance, order, fid) for the households in the grid
+        starting with the closest to lat, lng
+
+        the grid can be changed with .remove() between steps; orders that
+        have left the grid are not yielded
+        '''
+        row, col = self.cell_of(lat, lng)
+        self.min_cos = min(self.min_cos, cos(radians(abs(lat))))
+        heap = []
+        ring = 0
+        if self.bounds:
+            r_min, r_max, c_min, c_max = self.bounds
+            last_ring = max(abs(row - r_min), abs(row - r_max),
+                            abs(col - c_min), abs(col - c_max))
+        else:
+            last_ring = -1
+        while True:
+            found = []
+            if ring <= last_ring and 8 * ring > len(self.cells):
+                # the ring has more cells than there are cells with
+                # households in them.  Pick up everything that is left
+                for cell, members in self.cells.items():
+                    if max(abs(cell[0] - row), abs(cell[1] - col)) >= ring:
+                        found.extend(members.items())
+                ring = last_ring + 1
+            elif ring <= last_ring:
+                for cell in self.ring_cells(row, col, ring):
+                    members = self.cells.get(cell)
+                    if members:
+                        found.extend(members.items())
+                ring += 1
+            else:
+                ring += 1
+            if found:
+                h_lats = [x[1][1] for x in found]
+                h_lngs = [x[1][2] for x in found]
+                distances = haversine_array(lng, lat, h_lngs, h_lats).tolist()
+                for d, (order, (fid, _, _)) in zip(distances, found):
+                    heapq.heappush(heap, (d, order, fid))
+            if ring > last_ring:
+                floor_km = float('inf')
+            else:
+                floor_km = self.ring_floor(ring)
+            while heap and heap[0][0] < floor_km:
+                d, order, fid = heapq.heappop(heap)
+                if order in self.positions:
+                    yield (d, order, fid)
+            if ring > last_ring and not heap:
+                return
+
 class Delivery_Routes():
     '''
     Provides .sort_method() as a way of finding households that live within a
@@ -980,6 +1343,9 @@ class Delivery_Routes():
     max_boxes = the maximum number of boxes desired in a route
     start_count = the starting number to label routes.  Can be over ridden to
     maintain continunity of numbering when adding routes later.
+    routed_set = if True previously routed households are looked up in the
+    set of file ids the Route_Database loaded when it was opened so that a
+    full sort does not make a query per household (or per pair of them)
 
     Route data will be held in a database or the
     Delivery_Households_Collection() class and fed in as a batch job
@@ -987,10 +1353,25 @@ class Delivery_Routes():
 
     '''    
 
-    def __init__(self, route_db, max_boxes = 7, start_count = 1):
+    def __init__(self, route_db, max_boxes = 7, start_count = 1,
+                 routed_set=False):
         self.max_boxes = max_boxes # max number of boxes per/route
         self.start_count = start_count # what we start counting routes at
         self.route_db = route_db # a Delivery_Database object
+        self.routed_set = routed_set # use route_db.routed_ids not queries
+        self.timings = {} # step: seconds from the last sort
+
+    def sort_with(self, engine, households, mask=BOX_MASK, stop_on_dupes=False):
+        '''
+        calls the sort method that goes with engine
+        'grid' = .grid_sort_method()
+        'brute' = .sort_method()
+        '''
+        engines = {'grid': self.grid_sort_method,
+                   'brute': self.sort_method}
+        if engine not in engines:
+            raise ValueError(f'{engine} is not a sort engine. Try {SORT_ENGINES}')
+        engines[engine](households, mask=mask, stop_on_dupes=stop_on_dupes)
 
     def sort_method(self, households, mask=BOX_MASK, stop_on_dupes=False):
         '''
@@ -1009,6 +1390,7 @@ class Delivery_Routes():
         box_mask = mask
         max_box_count = self.max_boxes
         route_counter = self.start_count
+        smallest_box = min(box_mask.values())
         #routes = {} # labeled routes and the families they contain
         assigned = set() # container to add hh that have been assigned
         print('starting sort_method')
@@ -1026,7 +1408,9 @@ class Delivery_Routes():
             
             #sort_log.info(f'type of app_file_id is {type(app_file_id)}')
             routed_in_session = applicant.routed()
-            routed_in_db = households.has_been_routed_in_db(app_file_id, self.route_db)
+            routed_in_db = households.has_been_routed_in_db(app_file_id,
+                                                            self.route_db,
+                                                            self.routed_set)
             sort_log.info(f'{app_file_id} Routed in Session? \
                           {routed_in_session} Routed in DB {routed_in_db}')
             if not routed_in_session and not routed_in_db:
@@ -1035,53 +1419,31 @@ class Delivery_Routes():
                 #assigned.add(applicant) 
                 # start by adding the household we are starting with to the container for this route
                 applicant_route.append(app_file_id)
-                # build a container to add {calculated distances: households} to
-                # this will allow us to make a sorted list of the shortest distances and the HH
-                # that are at that distance            
-                distance_hh_dictionary = defaultdict(list)                                                                                                             
-                # ITERATE THROUGH THE HOUSEHOLDS AND CALCULATE DISTANCES FROM THE CHOSEN STARTING HH
-                for HH in households.delivery_iter_one(): # iterate through the keys to find the distances of remaining households                    
+                eligible = [] # file ids of households that can join the route
+                # ITERATE THROUGH THE HOUSEHOLDS AND FIND THE ONES THAT CAN JOIN
+                for HH in households.delivery_iter_one(): # iterate through the keys to find the distances of remaining households
                     # this method call does not pop the hh from the list
                     ident = HH.main_app_ID
                     not_currently_routed = (ident not in assigned and ident \
-                                            not in applicant_route)
+                                            not in applicant_route and not \
+                                            households.has_been_routed(ident))
                     routed_previously = households.has_been_routed_in_db(ident,
-                                                                         self.route_db)
+                                                                         self.route_db,
+                                                                         self.routed_set)
 
-                    #sort_log.info(f'looking at {ident}. not currently routed is {not_currently_routed} not in db {routed_previously}')
-                    #sort_log.info(f'type of ident {ident} is {type(ident)}')
                     if not_currently_routed and not routed_previously:
-                        # TO DO - clarify how to access households in this
-                        # block.  Should we iterate through objects or file
-                        # ids and then grab the object?
-                        h2_lat, h2_long = HH.geo_tuple # their lat,long
-                        # caculated the distance between the two households
-                        distance_between = haversine(h1_long, h1_lat, h2_long, h2_lat) # returns float distance in KM                        
-                        d_key = str(distance_between) # convert to string so we can use it as a dictionary key
-                        distance_hh_dictionary[d_key].append(ident) # update dictionary of distances: HH identifier
-
-                # now we have calculated all the distances from Route #X A to all of the other households in the caseload
-                # sort a list of all the distances so we can skim the shortest off
-                distances = sorted([float(k) for k in distance_hh_dictionary.keys()])
-                # NOW WE WILL ITERATE THROUGH THE DISTANCES AND TRY AND PUT A ROUTE TOGETHER
-                for float_value in distances: # for distance in sorted listed of distances
-                    key = str(float_value) # convert the float to a string so we can use it in the distance : families at that distance dictionary
-                    # now we need to iterate through the list of HH at this distance.
-                    for fam in distance_hh_dictionary[key]: # for the individual or family in the list of households at this distance
-                        if not households.has_been_routed(fam) and (fam not in\
-                                                                    applicant_route): # if we haven't sorted them into a route yet
-                            fam_size = households.get_size(fam) # determine family size
-                            box_num = box_mask[fam_size] # determine number of boxes
-                            # do math to determine if we can add them to the route
-                            # then if there are still more families at this distance we need to pop the one we just added
-                            # and evaluate the next one and so on down the chain until we max out box count per route or exaust
-                            # remaining households
-                            if box_num + boxes <= max_box_count: # if we added this family to the pile and they didn't add too many boxes
-                                boxes += box_num
-                                assigned.add(fam) # add them to the assigned list
-
-                                applicant_route.append(fam) # add them to the route
-            
+                        eligible.append(ident)
+                # NOW PICK THE CLOSEST ONES UNTIL THE ROUTE IS OUT OF BOXES
+                h2_lats, h2_longs = households.geo_arrays(eligible)
+                picked = nearest_unassigned(h1_lat, h1_long, eligible,
+                                            h2_lats, h2_longs,
+                                            max_box_count - boxes,
+                                            lambda fam: box_mask[households.get_size(fam)],
+                                            smallest_box)
+                for fam in picked:
+                    assigned.add(fam) # add them to the assigned list
+                    applicant_route.append(fam) # add them to the route
+
             else:
                 if stop_on_dupes and routed_in_db:
                     raise ValueError(f'FILE {app_file_id} is a duplicate')
@@ -1100,3 +1462,80 @@ class Delivery_Routes():
                 households.label_route(r_key, applicant_route)
                 route_counter += 1
 
+    def grid_sort_method(self, households, mask=BOX_MASK, stop_on_dupes=False,
+                         cell_size=0.01):
+        '''
+        Builds the same routes as .sort_method() but uses a Household_Grid()
+        to find the households closest to the starting household instead of
+        calculating and sorting the distance to every other household.
+
+        Households that are already routed in the database are left out of
+        the grid when it is built since the routes table does not change
+        during a sort.  The grid is asked for neighbours until the route
+        cannot take another box.
+
+        the time spent building the index and routing are stored in
+        .timings
+        '''
+        box_mask = mask
+        max_box_count = self.max_boxes
+        route_counter = self.start_count
+        smallest_box = min(box_mask.values())
+        assigned = set()
+        print('starting grid_sort_method')
+
+        tic = timeit.default_timer()
+        grid = Household_Grid(cell_size)
+        # orders are positions in the delivery_targets list.  The
+        # delivery_iter() pops from the end so the positions of the
+        # households left in the list never change
+        for order, fid in enumerate(households.delivery_targets):
+            if not households.has_been_routed_in_db(fid, self.route_db,
+                                                    self.routed_set):
+                lat, lng = households.hh_dict[fid].geo_tuple
+                grid.insert(order, fid, lat, lng)
+        toc = timeit.default_timer()
+        self.timings['index'] = toc - tic
+
+        for applicant in households.delivery_iter():
+            grid.remove(len(households.delivery_targets)) # the one just popped
+            applicant_route = []
+
+            h1_lat, h1_long = applicant.geo_tuple
+            size = str(applicant.hh_size)
+            boxes = box_mask[size]
+            app_file_id = applicant.main_app_ID
+
+            routed_in_session = applicant.routed()
+            routed_in_db = households.has_been_routed_in_db(app_file_id,
+                                                            self.route_db,
+                                                            self.routed_set)
+            sort_log.info(f'{app_file_id} Routed in Session? \
+                          {routed_in_session} Routed in DB {routed_in_db}')
+            if not routed_in_session and not routed_in_db:
+                applicant_route.append(app_file_id)
+                for _, order, fam in grid.nearest(h1_lat, h1_long):
+                    if boxes + smallest_box > max_box_count:
+                        break # nothing else will fit
+                    if fam in assigned or fam in applicant_route or \
+                       households.has_been_routed(fam):
+                        continue
+                    box_num = box_mask[households.get_size(fam)]
+                    if box_num + boxes <= max_box_count:
+                        boxes += box_num
+                        assigned.add(fam)
+                        applicant_route.append(fam)
+                        grid.remove(order)
+            else:
+                if stop_on_dupes and routed_in_db:
+                    raise ValueError(f'FILE {app_file_id} is a duplicate')
+                else:
+                    if routed_in_db: sort_log.info(f'ERROR: {app_file_id} is a duplicate. In session: {routed_in_session} In db: {routed_in_db}')
+
+            if applicant_route:
+                sort_log.info('we have iterated and made a route! It is {}'.format(applicant_route))
+                households.label_route(str(route_counter), applicant_route)
+                route_counter += 1
+
+        self.timings['routing'] = timeit.default_timer() - toc
+
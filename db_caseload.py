@@ -3,6 +3,8 @@ from collections import Counter
 from collections import defaultdict
 from datetime import datetime
 
+from db_migrations import migrate
+
 # SCHEMA USED TO CREATE THE DATABASE
 STRUCTURE = ('CREATE TABLE Visit_Table (Visit_Number_Key INTEGER ' \
              + 'NOT NULL PRIMARY KEY AUTOINCREMENT, hh_id INT, visit_date TEXT,' \
@@ -217,6 +219,7 @@ class Database():
                     self.conn.commit()
             elif first_time == True and not any(strings):
                 print('no strings provided to provision tables')
+            migrate(self.conn) # indexes and pragmas
 
         except Exception as e:
             print('could not establish connection to database')
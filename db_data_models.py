@@ -15,9 +15,11 @@ It allows access to the following objects
 
 import db_parse_functions as parse_functions
 import csv
+import sqlite3
 import sys
 from collections import Counter, defaultdict, namedtuple
 from datetime import datetime
+from functools import lru_cache
 
 import phonenumbers as pn
 
@@ -26,6 +28,8 @@ person_ethno_profile = namedtuple('person_ethno_profile', 'visible_minority, fir
 self_identifies_profile = namedtuple('self_identifies_profile', 'disabled, less_than_ten, other, NA, undisclosed')
 visit_tuple_structure = namedtuple('visit_tuple_structure', 'date, main_applicant_id, visit_object')
 a_person = namedtuple('a_person', 'ID, Lname, Fname, DOB, Age, Gender, Ethnicity, SelfIdent')
+visit_sum = namedtuple('visit_sum', 'applicant, fname, lname, size, phone, email,\
+                       address, address2, city, postal, diet, sa_app_num, sms_target')
 
 # date related variables to work with formats in the database
 DATE_FORMAT = '%Y-%m-%d' # this is the format to put into the caseload database
@@ -72,6 +76,60 @@ SERVICE_LIST = (SERVICE_AGENTS_HOF,
 
 TURKEY_PROVIDERS = SERVICE_AGENTS_HOF + SERVICE_AGENTS_SPONSOR
 
+# the agent lists as sets for the membership tests the Visit_Line_Object
+# runs on every line of a christmas export
+SERVICE_AGENTS_HOF_SET = frozenset(SERVICE_AGENTS_HOF)
+PICKUP_AGENTS_HOF_SET = frozenset(PICKUP_AGENTS_HOF)
+SERVICE_AGENTS_GIFTS_SET = frozenset(SERVICE_AGENTS_GIFTS)
+SERVICE_AGENTS_SPONSOR_SET = frozenset(SERVICE_AGENTS_SPONSOR)
+
+# FAMILY MEMBER FIELDS
+# key used by Field_Names.return_fam_header_indexes(): header of the first
+# family member.  The order is the order of the family member tuples
+FAMILY_MEMBER_HEADERS = (('ID', 'HH Mem 1- ID'),
+                         ('lname', 'HH Mem 1- Last Name'),
+                         ('fname', 'HH Mem 1- First Name'),
+                         ('dob', 'HH Mem 1- Date of Birth'),
+                         ('age', 'HH Mem 1- Age'),
+                         ('gender', 'HH Mem 1- Gender'),
+                         ('ethnicity', 'HH Mem 1- Ethnicities'),
+                         ('self_ident', 'HH Mem 1- Self-Identifies As'),
+                         ('relationship', 'HH Mem 1- Relationship to Main Client'),
+                         ('immigration', 'HH Mem 1- Immigration'))
+
+class Export_Schema():
+    '''
+    the layout of an export worked out once from its header row so that
+    nothing has to search the headers again line by line
+
+    .ID is {header: index} (the first column if a header is repeated)
+    .family_start is the index of the first family member block or None
+    .family_stride is how many columns each family member takes up.  If the
+    export only has room for one family member it is the rest of the line
+    from .family_start, and None if there are no family members at all
+    .member_offsets is a tuple of where each of the FAMILY_MEMBER_HEADERS
+    sits inside a family member block, None if the export does not have it
+    '''
+    def __init__(self, file_headers):
+        self.headers = tuple(file_headers)
+        self.ID = {}
+        for index, col_header in enumerate(self.headers):
+            self.ID.setdefault(col_header, index)
+        self.family_start = self.ID.get('HH Mem 1- ID', None)
+        self.family_stride = None
+        if self.family_start is not None and 'HH Mem 2- ID' in self.ID:
+            self.family_stride = self.ID['HH Mem 2- ID'] - self.family_start
+        elif self.family_start is not None:
+            # one block that runs to the end of the line
+            self.family_stride = len(self.headers) - self.family_start
+        offsets = [0]
+        for _, col_header in FAMILY_MEMBER_HEADERS[1:]:
+            if self.family_start is not None and col_header in self.ID:
+                offsets.append(self.ID[col_header] - self.family_start)
+            else:
+                offsets.append(None)
+        self.member_offsets = tuple(offsets)
+
 class Field_Names():
     '''
     Provides a way of interacting with data in the export by using the heading
@@ -87,13 +145,13 @@ class Field_Names():
         self.config_file= config_file # path to the config file
         self.ID = dict() # a dictionary of field name : index number as int()
         self.file_headers = None
+        self.schema = None # Export_Schema of the headers
 
         with open(self.config_file) as f:
             name_ID_reader = csv.reader(f)
             self.file_headers = next(name_ID_reader, None)
-            for col_header in self.file_headers:
-                col_header_index = self.file_headers.index(col_header)
-                self.ID[col_header] = col_header_index
+        self.schema = Export_Schema(self.file_headers)
+        self.ID = self.schema.ID
         #print(self.ID)
 
     def init_index_dict(self):
@@ -123,36 +181,8 @@ class Field_Names():
         and not require manual calibration of parsing functions to 
         use the correct index
         '''
-        fam_hd = {'ID' : 0,
-                'lname': None,
-                'fname': None,
-                'dob': None,
-                'age': None,
-                'gender': None,
-                'ethnicity': None,
-                'self_ident': None,
-                'relationship': None,
-                'immigration': None
-                 }
-
-        targets = ['HH Mem 1- Last Name','HH Mem 1- First Name',
-                   'HH Mem 1- Date of Birth', 'HH Mem 1- Age',
-                   'HH Mem 1- Gender','HH Mem 1- Ethnicities',
-                   'HH Mem 1- Self-Identifies As',
-                   'HH Mem 1- Relationship to Main Client',
-                   'HH Mem 1- Immigration']
-
-        reference = self.file_headers.index('HH Mem 1- ID')
-        d_t = list(fam_hd.keys())
-        dx = 0
- 
-        for k in d_t[1:]:
-            try:
-                fam_hd[k] = self.file_headers.index(targets[dx]) - reference
-                dx += 1
-            except:
-                dx += 1
-        
+        offsets = self.schema.member_offsets
+        fam_hd = {key: offsets[n] for n, (key, _) in enumerate(FAMILY_MEMBER_HEADERS)}
         return fam_hd
 
 class Service_Request():
@@ -165,14 +195,22 @@ class Service_Request():
 
     This is a Christmas Specific issue - differentiated by a different label
     for 
+
+    There are only a few hundred different service strings in an export
+    of thousands of lines so Service_Request.interned(service_str) should
+    be used to get one.  It parses each string once and hands the same
+    object back every time the string comes up again, so nothing should
+    modify a Service_Request once it has been made
     '''
+    _interned = {} # service_str: Service_Request
+
     def __init__(self, service_str):
         self.original = service_str
         self.services = service_str.split(',')
         self.num_bookings = len(self.services)
-        self.providers = []
-        self.requests = []
-        self.service_lookup = defaultdict(set) # keyed provider: request
+        providers = []
+        requests = []
+        service_lookup = defaultdict(set) # keyed provider: request
         self.service_dict = {} # keyed request: provider
         self.blank = True
 
@@ -181,15 +219,32 @@ class Service_Request():
                 # remove the last | and then split on the remaining one 
                 try:
                     request, provider = service[:-1].split('|') 
-                    self.requests.append(request)
-                    self.providers.append(provider)
+                    requests.append(request)
+                    providers.append(provider)
                     self.service_dict[request] = provider
-                    self.service_lookup[provider].add(request)
+                    service_lookup[provider].add(request)
                     self.blank = False
                 except:
-                    return None
+                    break
+        self.providers = tuple(providers)
+        self.requests = tuple(requests)
+        self.provider_set = frozenset(providers) # for intersecting with agents
+        # keyed provider: frozenset of requests
+        self.service_lookup = {p: frozenset(r) for p, r in service_lookup.items()}
         #print(f'SERVICE REQUEST: {self.service_dict} {self.service_lookup}')
 
+    @classmethod
+    def interned(cls, service_str):
+        '''
+        returns the shared Service_Request for service_str
+        parsing it the first time it is seen
+        '''
+        service_request = cls._interned.get(service_str)
+        if service_request is None:
+            service_request = cls(service_str)
+            cls._interned[service_str] = service_request
+        return service_request
+
     def lookup_request_provider(self, request):
         '''
         uses the service_dict attribute to find the service provider
@@ -210,7 +265,7 @@ class Service_Request():
         providers = False
         service = None
        
-        providers = set(agents).intersection(set(self.service_lookup.keys()))
+        providers = self.provider_set.intersection(agents)
         if get_service:
             service_list = []
             for service in providers:
@@ -251,7 +306,7 @@ class Service_Request():
         '''
         returns the orignal string if needed
         '''
-        return self.orignal
+        return self.original
 
 class Person():
     '''
@@ -264,6 +319,11 @@ class Person():
     details
     
     '''    
+    __slots__ = ('person_ID', 'person_Fname', 'person_Lname', 'person_DOB',
+                 'person_Age', 'person_Gender', 'person_Ethnicity',
+                 'person_Idenifies_As', 'person_Relationship',
+                 'person_immigration_date', 'person_HH_membership',
+                 'HH_Identities')
 
     def __init__(self, person_summary):
         self.person_ID = person_summary[0] # HH Mem X - ID
@@ -458,6 +518,7 @@ class Household():
     def __repr__(self):
         return 'Household {} has the following members {}'.format(self.Household_ID, self.Member_Set)
 
+@lru_cache(maxsize=parse_functions.NORMALIZER_CACHE_SIZE)
 def format_l2f_date(date_str, FORMAT=DATE_FORMAT, L2FORMAT=L2F_CSV_DATE_FORMAT):
     '''
     handles the dates that l2f throws out in the csv
@@ -479,6 +540,62 @@ def format_l2f_date(date_str, FORMAT=DATE_FORMAT, L2FORMAT=L2F_CSV_DATE_FORMAT):
     return datetime.strptime(date_str.replace('/','-'),\
                              L2FORMAT).strftime(FORMAT)
 
+def normalizer_stats():
+    '''
+    returns {name: CacheInfo(hits, misses, maxsize, currsize)} for the
+    memoized value parsers so it is possible to see how often a phone number,
+    date or diet had already been parsed
+    '''
+    return {'sms_target': Visit_Line_Object.get_sms_target.cache_info(),
+            'l2f_date': format_l2f_date.cache_info(),
+            'diet': parse_functions.diet_parser.cache_info()}
+
+# VISIT LINE OBJECT FIELDS
+# attribute: header for datapoints every export has
+VLO_REQUIRED_FIELDS = {'visit_Date': 'Visit Date',
+                       'main_applicant_ID': 'Client ID', # Main Applicant ID
+                       'main_applicant_Age': 'Client Age', # Main Applicant Age
+                       'visit_City': 'City',
+                       'visit_household_Size': 'Household Size'} # The Number of people included in the visit
+# attribute: header for datapoints that are None if the export does not
+# have the header
+VLO_OPTIONAL_FIELDS = {'main_applicant_Fname': 'Client First Name',
+                       'main_applicant_Lname': 'Client Last Name',
+                       'main_applicant_DOB': 'Client Date of Birth',
+                       'main_applicant_Gender': 'Client Gender',
+                       'main_applicant_Email': 'Client Email Addresses',
+                       'main_applicant_Ethnicity': 'Client Ethnicities',
+                       'main_applicant_Self_Identity': 'Client Self-Identifies As',
+                       'languages': 'Household Languages',
+                       'immigration_date': 'Client Immigration',
+                       'delivery': 'Delivery',
+                       'household_primary_SOI': 'Household Primary Income Source', # Client Primary Source of Income
+                       'visit_Postal_Code': 'Postal Code',
+                       'lat': 'Latitude', # latitude
+                       'lng': 'Longitude', # longitude
+                       'housing_type': 'Housing Type', # Housing type string
+                       'visit_Agency': 'Visited Agency', # organization that provided services
+                       'first_visit': 'Client First Food Bank Visit-Date',
+                       'visit_Referral': 'Referrals Provided'} # Referrals Provided
+# attribute: Visit_Line_Object method that sets it.  Some of the methods set
+# more than one attribute
+VLO_DECODERS = {'foods_provided': '_decode_services',
+                'items_provided': '_decode_services',
+                'visit_household_Diet': '_decode_diet',
+                'visit_food_hamper_type': '_decode_quantity',
+                'quantity': '_decode_quantity',
+                'visit_Address': '_decode_address',
+                'visit_Address_Line2': '_decode_address',
+                'main_applicant_Phone': '_decode_phone',
+                'visit_Household_ID': '_decode_household_id',
+                'visit_Family_Slice': '_decode_family_slice',
+                'xmas_ID': '_decode_xmas',
+                'xmas_notes': '_decode_xmas',
+                'xmas_application_site': '_decode_xmas',
+                'ex_reference': '_decode_xmas'}
+VLO_FIELDS = (tuple(VLO_REQUIRED_FIELDS) + tuple(VLO_OPTIONAL_FIELDS) + 
+              tuple(VLO_DECODERS))
+
 class Visit_Line_Object():
     '''
     this is the VLO
@@ -496,50 +613,30 @@ class Visit_Line_Object():
     to reference where data points are on the visit_line
     :param: december_flag = a marker to toggle looking for Christmas related
     headers
+    :param: fields = the attributes to extract from the line straight away.
+    None (the default) extracts all of them.  Anything else is extracted the
+    first time it is used, so a caller that only needs a few datapoints to
+    decide whether to keep a line can skip the rest i.e.
+    Visit_Line_Object(line, fnames.ID, fields=('main_applicant_ID',))
+
+    A VLO is made for every line of the export, so it uses __slots__
+    rather than an instance __dict__.  An unset slot still falls through
+    to __getattr__ which is how the fields that were not asked for get
+    extracted
 
     '''    
+    __slots__ = ('_line', '_fnamedict', '_december_flag',
+                 'HH_main_applicant_profile', 'HH_family_members_profile',
+                 'sa_status', 'sa_app_num', 'sms_target', 'hof_zone',
+                 'hof_pu_num', 'item_req', 'food_req', 'delivery_h',
+                 'f_sponsor', 'g_sponsor') + VLO_FIELDS
     
-    def __init__(self, visit_line, fnamedict, december_flag = False): # line, dict of field name indexes, is Xmas?
-        #self.vline = visit_line
-        self.visit_Date = visit_line[fnamedict['Visit Date']]
-        self.main_applicant_ID = visit_line[fnamedict['Client ID']] # Main Applicant ID
-        self.main_applicant_Fname = None
-        self.main_applicant_Lname = None
-        self.main_applicant_DOB = None
-        self.main_applicant_Age = visit_line[fnamedict['Client Age']] # Main Applicant Age
-        self.main_applicant_Gender = None # Main Applicant Gender
-        self.main_applicant_Phone = None # Main Applicant Phone Numbers
-        self.main_applicant_Email = None
-        self.main_applicant_Ethnicity = None
-        self.main_applicant_Self_Identity = None
-        self.languages = None
-        self.immigration_date = None
-        self.delivery = None
-        self.household_primary_SOI = None # Client Primary Source of Income
-        self.visit_Address = None 
-        self.visit_Address_Line2 = None
-        self.visit_City = visit_line[fnamedict['City']]
-        self.visit_Postal_Code = None
-        self.lat = None # latitude
-        self.lng = None # longitude
-        self.housing_type = None # Housing type string
-        self.visit_Household_ID = None  # Household ID - the unique file number used to identify households
-        self.visit_household_Size = visit_line[fnamedict['Household Size']] # The Number of people included in the visit
-        self.visit_household_Diet = None # Dietary Conditions in a readable form
-        self.visit_food_hamper_type = None 
-        self.visit_Family_Slice = None
-        self.visit_Agency = None # organization that provided services
-        self.first_visit = None
+    def __init__(self, visit_line, fnamedict, december_flag = False, fields=None): # line, dict of field name indexes, is Xmas?
+        self._line = visit_line
+        self._fnamedict = fnamedict
+        self._december_flag = december_flag
         self.HH_main_applicant_profile = None
         self.HH_family_members_profile = None
-        self.visit_Referral = None # Referrals Provided
-        self.quantity = None
-        self.foods_provided = None # Normal is food prov. Xmas is foods prov. fml
-        self.items_provided = visit_line[fnamedict['Items Provided']]
-        self.xmas_ID = None
-        self.xmas_notes = None
-        self.xmas_application_site = None
-        self.ex_reference = None # holds the sms number if recorded
         # set by methods
         self.sa_status = None # has SA appointment?
         self.sa_app_num = None # SA appointment number - coded between ##x##
@@ -554,50 +651,98 @@ class Visit_Line_Object():
         self.f_sponsor = None # a list
         self.g_sponsor = None # a list
 
+        # the datapoints on the line.  With fields=None they are all
+        # extracted now, otherwise only the ones named in fields are and
+        # the rest are extracted by __getattr__ the first time they are used
+        if fields is None:
+            for name, header in VLO_REQUIRED_FIELDS.items():
+                setattr(self, name, visit_line[fnamedict[header]])
+            for name, header in VLO_OPTIONAL_FIELDS.items():
+                index = fnamedict.get(header, False)
+                setattr(self, name, visit_line[index] if index else None)
+            for decoder in Visit_Line_Object._decoder_methods:
+                decoder(self, visit_line, fnamedict)
+        else:
+            decoded = set() # so fields that share a decoder run it once
+            for field in fields:
+                decoder = VLO_DECODERS.get(field, field)
+                if decoder not in decoded:
+                    decoded.add(decoder)
+                    self._decode(field)
+
+    def __getattr__(self, name):
+        '''
+        only called when name is not set yet, so this extracts the
+        datapoints that were not asked for when the VLO was made
+        '''
+        if name in VLO_REQUIRED_FIELDS or name in VLO_OPTIONAL_FIELDS or \
+           name in VLO_DECODERS:
+            self._decode(name)
+            return getattr(self, name)
+        raise AttributeError(f'Visit_Line_Object has no attribute {name}')
+
+    def __getstate__(self):
+        '''
+        returns the slots that have been set so that pickling a VLO
+        doesn't extract the rest of the line through __getattr__
+        '''
+        state = {}
+        for name in Visit_Line_Object.__slots__:
+            try:
+                state[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _decode(self, name):
+        '''
+        sets the attribute name (and any that are extracted alongside it)
+        from the line
+        '''
+        visit_line = self._line
+        fnamedict = self._fnamedict
+        if name in VLO_REQUIRED_FIELDS:
+            setattr(self, name, visit_line[fnamedict[VLO_REQUIRED_FIELDS[name]]])
+        elif name in VLO_OPTIONAL_FIELDS:
+            index = fnamedict.get(VLO_OPTIONAL_FIELDS[name], False)
+            setattr(self, name, visit_line[index] if index else None)
+        else:
+            getattr(self, VLO_DECODERS[name])(visit_line, fnamedict)
+
+    def _decode_services(self, visit_line, fnamedict):
+        self.foods_provided = None # Normal is food prov. Xmas is foods prov. fml
+        self.items_provided = visit_line[fnamedict['Items Provided']]
         if fnamedict.get('Food Provided', False): # non Christmas
             self.foods_provided = visit_line[fnamedict['Food Provided']]
         elif fnamedict.get('Foods Provided', False): # it's Christmas - we need
                                                      # to use the Service_Request object
-            self.foods_provided = Service_Request(visit_line[fnamedict['Foods Provided']])
-            self.items_provided = Service_Request(visit_line[fnamedict['Items Provided']])
+            self.foods_provided = Service_Request.interned(visit_line[fnamedict['Foods Provided']])
+            self.items_provided = Service_Request.interned(visit_line[fnamedict['Items Provided']])
+
+    def _decode_diet(self, visit_line, fnamedict):
+        self.visit_household_Diet = None # Dietary Conditions in a readable form
         if fnamedict.get('Dietary Considerations', False):
             self.visit_household_Diet = parse_functions.diet_parser(visit_line[fnamedict['Dietary Considerations']]) # Dietary Conditions in a readable form
-        if fnamedict.get('Client Ethnicities', False):
-            self.main_applicant_Ethnicity = visit_line[fnamedict['Client Ethnicities']]
-        if fnamedict.get('Household Languages', False):
-            self.languages = visit_line[fnamedict['Household Languages']]
-        if fnamedict.get('Client Immigration', False):
-            self.immigration_date = visit_line[fnamedict['Client Immigration']]
-        if fnamedict.get('Delivery', False):
-            self.delivery = visit_line[fnamedict['Delivery']]
 
+    def _decode_quantity(self, visit_line, fnamedict):
+        self.visit_food_hamper_type = None 
+        self.quantity = None
         if fnamedict.get('Quantity', False):
             self.visit_food_hamper_type = parse_functions.hamper_type_parser(int(fnamedict['Quantity'])) # Quantity of food parsed to be Food or Baby 3 = hamper 1 = baby hamper
             self.quantity = visit_line[fnamedict['Quantity']]
-        if fnamedict.get('Client First Name', False):
-            self.main_applicant_Fname = visit_line[fnamedict['Client First Name']] # Main Applicant First Name
-        if fnamedict.get('Client Last Name', False):
-            self.main_applicant_Lname = visit_line[fnamedict['Client Last Name']] # Main Applicant Last Name
-        if fnamedict.get('Client Date of Birth', False):
-            self.main_applicant_DOB = visit_line[fnamedict['Client Date of Birth']] # Main A DOB
-        if fnamedict.get('Client Self-Identifies As', False):
-            self.main_applicant_Self_Identity = visit_line[fnamedict['Client Self-Identifies As']] 
-        if fnamedict.get('Client First Food Bank Visit-Date', False):
-            self.first_visit = visit_line[fnamedict['Client First Food Bank Visit-Date']]
-        
+
+    def _decode_address(self, visit_line, fnamedict):
         # ADDRESS RELATED SWITCHES
+        self.visit_Address = None 
+        self.visit_Address_Line2 = None
         if fnamedict.get('Address', False): # used by the L2F Services Export
             self.visit_Address = visit_line[fnamedict['Address']] 
         if fnamedict.get('Street', False): # used by the normal L2F Export
             self.visit_Address = visit_line[fnamedict['Street']]
-        if fnamedict.get('Latitude', False):
-            self.lat = visit_line[fnamedict['Latitude']]
-        if fnamedict.get('Longitude', False):
-            self.lng = visit_line[fnamedict['Longitude']]
-        if fnamedict.get('Housing Type', False):
-            self.housing_type = visit_line[fnamedict['Housing Type']]
-        if fnamedict.get('Postal Code', False):
-            self.visit_Postal_Code = visit_line[fnamedict['Postal Code']]
         if fnamedict.get('Line 2', False):
             self.visit_Address_Line2 = visit_line[fnamedict['Line 2']]
         elif not fnamedict.get('Line 2', False): 
@@ -617,24 +762,27 @@ class Visit_Line_Object():
             except:
                 pass
 
-        if fnamedict.get('Client Gender', False):
-            self.main_applicant_Gender = visit_line[fnamedict['Client Gender']] # Main Applicant Gender
+    def _decode_phone(self, visit_line, fnamedict):
+        self.main_applicant_Phone = None # Main Applicant Phone Numbers
         if fnamedict.get('Client Phone Numbers', False):
             self.main_applicant_Phone = visit_line[fnamedict['Client Phone Numbers']].split(',') # Main Applicant Phone Numbers
-        if fnamedict.get('Household Primary Income Source',False):
-            self.household_primary_SOI = visit_line[fnamedict['Household Primary Income Source']]
+
+    def _decode_household_id(self, visit_line, fnamedict):
+        self.visit_Household_ID = None  # Household ID - the unique file number used to identify households
         if fnamedict.get('Household ID', False):
             self.visit_Household_ID = str(visit_line[fnamedict['Household ID']])
-        if fnamedict.get('Referrals Provided', False):
-            self.visit_Referral = visit_line[fnamedict['Referrals Provided']] # Referrals Provided
+
+    def _decode_family_slice(self, visit_line, fnamedict):
+        self.visit_Family_Slice = None
         if fnamedict.get('HH Mem 1- ID', False):
             self.visit_Family_Slice = visit_line[fnamedict['HH Mem 1- ID']:]
-        if fnamedict.get('Visited Agency', False):
-            self.visit_Agency = visit_line[fnamedict['Visited Agency']]
-        if fnamedict.get('Client Email Addresses', False):
-            self.main_applicant_Email = visit_line[fnamedict['Client Email Addresses']]
 
-        if december_flag: # enforce items and food lines in export existing
+    def _decode_xmas(self, visit_line, fnamedict):
+        self.xmas_ID = None
+        self.xmas_notes = None
+        self.xmas_application_site = None
+        self.ex_reference = None # holds the sms number if recorded
+        if self._december_flag: # enforce items and food lines in export existing
             self.xmas_ID = visit_line[fnamedict['Request ID']]
             self.xmas_notes = visit_line[fnamedict['Notes Recorded']]
             self.xmas_application_site = visit_line[fnamedict['Requesting Agency']]
@@ -754,6 +902,7 @@ class Visit_Line_Object():
             return False
 
     @staticmethod
+    @lru_cache(maxsize=parse_functions.NORMALIZER_CACHE_SIZE)
     def get_sms_target(sms_string):
         '''
         takes the string that likely contains a cell phone number and attempts 
@@ -768,6 +917,8 @@ class Visit_Line_Object():
         this method is used by the is_army() method to set the .sms_target
         attribute
 
+        results are memoized, so an invalid number is only printed the
+        first time it comes up
         '''
         #if sms_string[0] != '1': sms_string = f'{1}{sms_string}'
 
@@ -823,8 +974,6 @@ class Visit_Line_Object():
         fields for a delivery card
         '''
 
-        visit_sum = namedtuple('visit_sum', 'applicant, fname, lname, size, phone, email,\
-                               address, address2, city, postal, diet, sa_app_num, sms_target')
         return visit_sum(self.main_applicant_ID,
                          self.main_applicant_Fname,
                          self.main_applicant_Lname,
@@ -887,12 +1036,13 @@ class Visit_Line_Object():
         correctly cut the line into the correct size lengths and then slot the
         data into tuples
         '''
-        sub_slice_len = header_object.return_family_subslice_len()
-        # create a dictionary of index numbers for each of the data points
-        h_d = header_object.return_fam_header_indexes()
+        # the block length and the offsets of each of the data points were
+        # worked out once when the headers were read
+        schema = header_object.schema
 
         family_members = parse_functions.create_list_of_family_members_as_tuples(self.visit_Family_Slice,
-                                                                sub_slice_len, h_d)
+                                                                schema.family_stride,
+                                                                schema.member_offsets)
         # 0 ID, 1 Lname, 2 Fname, 3 DOB, 4 Age, 5 Gender, 6 ethnicity, 7 identity,
         # 8 relationship, 9 immigration date
         return family_members 
@@ -922,8 +1072,8 @@ class Visit_Line_Object():
         '''
         return self.visit_food_hamper_type # True or False
     
-    def is_christmas_hamper(self, pu_list=PICKUP_AGENTS_HOF, 
-                            service_list=SERVICE_AGENTS_HOF):
+    def is_christmas_hamper(self, pu_list=PICKUP_AGENTS_HOF_SET, 
+                            service_list=SERVICE_AGENTS_HOF_SET):
         '''
         Christmas_Hamper denotes a service offered by J Cramer's 
         home team rather than a 3rd party or sponsor. 
@@ -941,15 +1091,16 @@ class Visit_Line_Object():
         provider = [] 
         food = False
         item = False
+        service_list = frozenset(service_list) # not copied if it already is one
         if not self.foods_provided.blank:
-            hof_food = set(service_list).intersection(set(self.foods_provided.providers))
+            hof_food = service_list.intersection(self.foods_provided.provider_set)
 
             if hof_food:
                 food = True
                 is_hof = True 
                 provider += list(hof_food)
         if not self.items_provided.blank:
-            hof_items = set(service_list).intersection(set(self.items_provided.providers))
+            hof_items = service_list.intersection(self.items_provided.provider_set)
 
             if hof_items:
                 item = True
@@ -962,7 +1113,7 @@ class Visit_Line_Object():
             if sms:
                 self.sms_target = sms
             # determine service type Delivery or Pickup
-            pu_intersect = set(provider).intersection(set(pu_list))
+            pu_intersect = set(provider).intersection(frozenset(pu_list))
             if pu_intersect:
                 
                 self.hof_zone = list(pu_intersect)[0] # will be HoF Zone 1 etc. 
@@ -990,8 +1141,8 @@ class Visit_Line_Object():
 
         return is_hof
 
-    def is_sponsored_hamper(self, food_sponsors=SERVICE_AGENTS_SPONSOR, 
-                            toy_sponsors=SERVICE_AGENTS_GIFTS):
+    def is_sponsored_hamper(self, food_sponsors=SERVICE_AGENTS_SPONSOR_SET, 
+                            toy_sponsors=SERVICE_AGENTS_GIFTS_SET):
         '''
         performs a check to see if this a Sponsored Hamper
         by calling Service_Request methods held at the .foods_provided
@@ -1001,10 +1152,10 @@ class Visit_Line_Object():
             True, food_sponsor, toy_sponsor
             False, None, None
         '''
-        food_sponsor = set(self.foods_provided.providers).\
-                intersection(set(food_sponsors))
-        gift_sponsor = set(self.items_provided.providers).\
-                intersection(set(toy_sponsors))
+        food_sponsor = self.foods_provided.provider_set.\
+                intersection(food_sponsors)
+        gift_sponsor = self.items_provided.provider_set.\
+                intersection(toy_sponsors)
 
         if food_sponsor or gift_sponsor:
             fs = None
@@ -1053,7 +1204,7 @@ class Visit_Line_Object():
         '''
         
         for label in army_label.keys():
-            if label in self.items_provided.providers:
+            if label in self.items_provided.provider_set:
                 
                 # modify key status registers
                 self.sa_status = True
@@ -1095,6 +1246,10 @@ class Visit_Line_Object():
         return '{} {}'.format(self.visit_Date, 
                               self.main_applicant_ID)
 
+# the decoders in the order an eager Visit_Line_Object runs them
+Visit_Line_Object._decoder_methods = tuple(getattr(Visit_Line_Object, d) for d
+                                           in dict.fromkeys(VLO_DECODERS.values()))
+
 class Visit():
     '''
     Contains data related to a visit : 
@@ -1102,6 +1257,9 @@ class Visit():
     most often we will only have an export from one agency, but sometimes it is possible
     to pool data from multiple service providers
     '''
+    __slots__ = ('vnumber', 'vdate', 'main_applicant', 'family_members',
+                 'householdID', 'address', 'service_provider')
+
     def __init__(self, vnumber, date, main_applicant, family_members, householdID, address, agency=None):
        self.vnumber = vnumber
        self.vdate = date
@@ -1149,6 +1307,187 @@ class Visit():
     def __repr__(self):
         return 'Visit #{} Had applicant: {}'.format(self.vnumber, self.main_applicant)
 
+class Export_Store():
+    '''
+    where Export_File_Parser.parse_visits() puts the people, households and
+    visits it finds.  Each parser gets its own store, which is a private
+    SQLite database that sqlite keeps in a temporary file and deletes when
+    it is closed.  Only the pages in use are held in memory, so a multi year
+    export can be parsed without holding a Person and Visit object for every
+    row.  The tables are keyed on the ids so the objects can be rebuilt on
+    demand with .person(), .household() and .visit()
+
+    person = (ID, Lname, Fname, DOB, Age, Gender, Ethnicity, SelfIdent,
+    Relationship, Immigration) the same order as a Person() takes
+    '''
+    TABLES = ('''CREATE TABLE person (person_id TEXT PRIMARY KEY, lname TEXT,
+              fname TEXT, dob TEXT, age TEXT, gender TEXT, ethnicity TEXT,
+              identity TEXT, relationship TEXT, immigration TEXT)''',
+              # one row per visit a person is part of
+              'CREATE TABLE person_household (person_id TEXT, household_id TEXT)',
+              'CREATE INDEX idx_person_household ON person_household (person_id)',
+              'CREATE TABLE household (household_id TEXT PRIMARY KEY)',
+              '''CREATE TABLE household_member (household_id TEXT, person_id TEXT,
+              UNIQUE (household_id, person_id))''',
+              '''CREATE TABLE visit (visit_number TEXT PRIMARY KEY, vdate TEXT,
+              main_applicant TEXT, household_id TEXT, address TEXT, city TEXT,
+              postal TEXT)''',
+              'CREATE INDEX idx_visit_household ON visit (household_id)',
+              # the family members in the visit in the order of the line
+              'CREATE TABLE visit_family (visit_number TEXT, person_id TEXT)',
+              'CREATE INDEX idx_visit_family ON visit_family (visit_number)')
+    INSERTS = ('INSERT OR IGNORE INTO person VALUES (?,?,?,?,?,?,?,?,?,?)',
+               'INSERT INTO person_household VALUES (?,?)',
+               'INSERT OR IGNORE INTO household VALUES (?)',
+               'INSERT OR IGNORE INTO household_member VALUES (?,?)',
+               'INSERT OR IGNORE INTO visit VALUES (?,?,?,?,?,?,?)',
+               'INSERT INTO visit_family VALUES (?,?)')
+    BATCH = 1000 # visits held back before they are written
+
+    def __init__(self):
+        self.conn = sqlite3.connect('') # '' = temporary database on disk
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        for statement in Export_Store.TABLES:
+            self.conn.execute(statement)
+        # rows waiting to be written, in the order of INSERTS
+        self.pending = tuple([] for _ in Export_Store.INSERTS)
+        self.pending_visits = 0
+
+    @staticmethod
+    def person_row(individual):
+        '''
+        returns the person tuple from a main applicant or family member tuple
+        the main applicant tuple from Visit_Line_Object.get_main_applicant()
+        does not have a relationship so it is left blank
+        '''
+        if len(individual) == 9:
+            individual = (*individual[:8], None, individual[8])
+        return (str(individual[0]), *individual[1:10])
+
+    def add_visit(self, visit_number, vdate, main_applicant, family,
+                  household_id, address):
+        '''
+        stores a visit, the people in it and adds them to the household.
+        main_applicant and family are the tuples from the Visit_Line_Object
+        either of them can be None
+        '''
+        persons, memberships, households, members, visits, families = self.pending
+        people = [self.person_row(p) for p in ((main_applicant,) if main_applicant else ())]
+        family_rows = [self.person_row(p) for p in family or ()]
+        people.extend(family_rows)
+        persons.extend(people)
+        memberships.extend((p[0], household_id) for p in people)
+        if household_id is not None:
+            households.append((household_id,))
+            members.extend((household_id, p[0]) for p in people)
+        street, city, postal = address or (None, None, None)
+        visits.append((visit_number, vdate,
+                       str(main_applicant[0]) if main_applicant else None,
+                       household_id, street, city, postal))
+        families.extend((visit_number, p[0]) for p in family_rows)
+        self.pending_visits += 1
+        if self.pending_visits >= Export_Store.BATCH:
+            self.flush()
+
+    def flush(self):
+        '''
+        writes the rows that are waiting to be written
+        '''
+        for statement, rows in zip(Export_Store.INSERTS, self.pending):
+            if rows:
+                self.conn.executemany(statement, rows)
+                rows.clear()
+        self.pending_visits = 0
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+
+    def counts(self):
+        '''
+        returns {'people': n, 'households': n, 'visits': n}
+        '''
+        self.flush()
+        return {label: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for label, table in (('people', 'person'),
+                                     ('households', 'household'),
+                                     ('visits', 'visit'))}
+
+    def ids(self, table):
+        '''
+        yields the ids in 'person', 'household' or 'visit'
+        '''
+        self.flush()
+        column = {'person': 'person_id', 'household': 'household_id',
+                  'visit': 'visit_number'}[table]
+        for row in self.conn.execute(f'SELECT {column} FROM {table} ORDER BY rowid'):
+            yield row[0]
+
+    def person_tuple(self, person_id):
+        '''
+        returns the stored person tuple or None
+        '''
+        self.flush()
+        return self.conn.execute('SELECT * FROM person WHERE person_id=?',
+                                 (person_id,)).fetchone()
+
+    def person(self, person_id):
+        '''
+        returns a Person with the households they visited as a part of
+        or None if person_id has not been stored
+        '''
+        row = self.person_tuple(person_id)
+        if row is None:
+            return None
+        person = Person(row)
+        for hhid, in self.conn.execute('''SELECT household_id FROM person_household
+                                       WHERE person_id=? ORDER BY rowid''', (person_id,)):
+            person.add_HH_visit(hhid)
+        return person
+
+    def visit(self, visit_number):
+        '''
+        returns a Visit or None if visit_number has not been stored
+        '''
+        self.flush()
+        row = self.conn.execute('SELECT * FROM visit WHERE visit_number=?',
+                                (visit_number,)).fetchone()
+        if row is None:
+            return None
+        vnumber, vdate, main_applicant, household_id, street, city, postal = row
+        family = [self.person_tuple(pid) for pid, in self.conn.execute(
+            'SELECT person_id FROM visit_family WHERE visit_number=? ORDER BY rowid',
+            (visit_number,))]
+        mapp = self.person_tuple(main_applicant) if main_applicant else None
+        address = (street, city, postal) if any((street, city, postal)) else None
+        return Visit(vnumber, vdate, mapp, family or None, household_id, address)
+
+    def household(self, household_id):
+        '''
+        returns a Household with its members and visits
+        or None if household_id has not been stored
+        '''
+        self.flush()
+        if not self.conn.execute('SELECT 1 FROM household WHERE household_id=?',
+                                 (household_id,)).fetchone():
+            return None
+        household = Household(household_id)
+        household.add_members([pid for pid, in self.conn.execute(
+            'SELECT person_id FROM household_member WHERE household_id=?',
+            (household_id,))])
+        for vnumber, in self.conn.execute(
+                'SELECT visit_number FROM visit WHERE household_id=? ORDER BY rowid',
+                (household_id,)).fetchall():
+            household.add_visit(vnumber, self.visit(vnumber))
+        return household
+
+    def close(self):
+        '''
+        closes the connection, which deletes the temporary database
+        '''
+        self.conn.close()
+
 class Export_File_Parser():
     '''
     a file object for the L2F export. This will be the single method for interacting 
@@ -1164,16 +1503,16 @@ class Export_File_Parser():
     file_path = path to csv file
     header_names = a Field_Names object
 
+    parse_visits() puts what it finds in the .store, an Export_Store that
+    belongs to this parser.  .close() closes the file and throws it away
+
     '''   
     
-    # DICTIONARIES TO STORE OBJECTS
-    Person_Table = dict()
-    Household_Table = dict()
-    Visit_Table = dict()
-    
     def __init__(self, file_path, header_names, start_counter_at = 1):
         self.path = file_path
+        self.csv_file = None # the open file set by open_file method
         self.file_object = None # csv reader object set by open_file method
+        self.store = None # Export_Store set by parse_visits method
         self.headers = header_names.ID # dictionary from a Field_Names object
         self.header_object = header_names
         self.line_counter = start_counter_at # the index for the visits 1 = visit one
@@ -1189,19 +1528,48 @@ class Export_File_Parser():
         opens the csv file and sets the file_object variable 
         to be the file minus headers
         '''
-        csv_file = open(self.path, newline='')
-        visit_reader = csv.reader(csv_file)
+        self.csv_file = open(self.path, newline='')
+        visit_reader = csv.reader(self.csv_file)
         next(visit_reader, None) # skip headers
         print('File Open.')
         self.file_object = visit_reader               
 
+    def lines_from(self, offset=None):
+        '''
+        yields (line, offset) for each line of the file minus headers where
+        offset is where the line after it starts in the file.  Pass one of
+        those offsets back in to start reading from there instead of the top
+
+        the offsets come from .tell() so they only mean something for the
+        file they came from
+        '''
+        with open(self.path, newline='') as csv_file:
+            if offset is not None:
+                csv_file.seek(offset)
+            position = csv_file.tell()
+
+            def rows():
+                nonlocal position
+                # readline() instead of iterating the file so .tell() works
+                for row in iter(csv_file.readline, ''):
+                    position = csv_file.tell()
+                    yield row
+
+            visit_reader = csv.reader(rows())
+            if offset is None:
+                next(visit_reader, None) # skip headers
+            for line in visit_reader:
+                yield line, position
+
     def parse_visits(self):
         '''
         opens the file and parses it into visits
         and sub objects
-        adds things to the visit_structure Export_File Class variable
+        adds the people, households and visits to the .store
         '''
         if self.file_object:
+            if self.store is None:
+                self.store = Export_Store()
             for visit_line in self.file_object:
                 # extract people in visit
                 # create person objects for them
@@ -1213,48 +1581,39 @@ class Export_File_Parser():
                 vdate = line_object.get_visit_date()
                 mapp = None # main applicant
                 famapp = None # family memmbers
-                people_in_visit = [] # list of tuples
                 household_id_number = None
                 visit_address = None
-                people_in_visit_id_list = []
-                household_object = None
-                visit_object = None
                 
                 if line_object.is_hamper():
                     mapp = line_object.get_main_applicant()
-                    people_in_visit.append(mapp)                     
                     visit_address = line_object.get_address()
                     household_id_number = line_object.get_hh_id_number()
                 if line_object.has_family():
                     famapp = line_object.get_family_members(self.header_object)
-                    people_in_visit.extend(famapp)
+                    # need some code to map out relationships                                        
 
-                for individual in people_in_visit:
-                    file_id_number = str(individual[0])
-                    people_in_visit_id_list.append(file_id_number)
-                    if file_id_number not in Export_File_Parser.Person_Table.keys():
-                        Export_File_Parser.Person_Table[file_id_number] = Person(individual)
-                        # need some code to map out relationships                                        
-
-                    Export_File_Parser.Person_Table[file_id_number].add_HH_visit(household_id_number)
-
-                if household_id_number not in Export_File_Parser.Household_Table.keys():
-                    household_object = Household(household_id_number)
-                    Export_File_Parser.Household_Table[household_id_number] = household_object
-                
-                if line_number not in Export_File_Parser.Visit_Table.keys():
-                    visit_object = Visit(line_number, vdate, mapp, famapp, household_id_number, visit_address)
-                    Export_File_Parser.Visit_Table[line_number] = visit_object
-
-                household_object.add_members(people_in_visit_id_list)
-                household_object.add_visit(line_number, visit_object)
+                self.store.add_visit(line_number, vdate, mapp, famapp,
+                                     household_id_number, visit_address)
 
                 self.line_counter +=1               
 
+            self.store.commit()
                 
         else:
             print('The file {} has not been opened yet.'.format(self.path))
 
+    def close(self):
+        '''
+        closes the csv file and the .store
+        '''
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = None
+            self.file_object = None
+        if self.store:
+            self.store.close()
+            self.store = None
+
 
 
 if __name__ == "__main__":
@@ -1263,6 +1622,5 @@ if __name__ == "__main__":
     L2F_2017 = Export_File_Parser('test_export.csv',fnames) 
     L2F_2017.open_file() # open the file
     L2F_2017.parse_visits() # parse the visits into the different objects
-    print(L2F_2017.Person_Table)
-    print(L2F_2017.Household_Table)
-    print(L2F_2017.Visit_Table)
+    print(L2F_2017.store.counts())
+    L2F_2017.close()
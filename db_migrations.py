@@ -0,0 +1,101 @@
+#!/usr/bin/python3.6
+'''
+Schema changes and connection settings for the SQLite databases used by
+the scripts: the route database (Route_Database), the address database
+(SQLdatabase) and the caseload database (db_caseload.Database)
+
+migrate() is called every time one of those classes opens a connection.
+Everything it does is safe to repeat, so it can be run against the
+existing production .db files as often as needed.  It will
+
+1. switch the database to WAL journal mode and set the pragmas that
+speed up the connection
+2. create indexes on the columns the scripts look things up by.  An index
+is only created if its table exists in the database being opened
+
+it can also be run from the command line against one or more files
+
+python3 db_migrations.py databases/2019_production_rdb.db databases/Address.db
+'''
+
+import sqlite3
+import sys
+
+# settings applied to every connection.  journal_mode=WAL sticks to the
+# file once it is set, the rest only last as long as the connection
+PRAGMAS = ('PRAGMA journal_mode=WAL',
+           'PRAGMA synchronous=NORMAL',
+           'PRAGMA cache_size=-64000', # 64MB page cache
+           'PRAGMA mmap_size=268435456', # 256MB memory map
+           'PRAGMA temp_store=MEMORY')
+
+# table: index statements for it
+INDEXES = {
+    # route database
+    'routes': ('CREATE INDEX IF NOT EXISTS idx_routes_route_number ON routes (route_number)',),
+    'family': ('CREATE INDEX IF NOT EXISTS idx_family_main_applicant ON family (main_applicant)',),
+    # address database
+    'address': ('CREATE INDEX IF NOT EXISTS idx_address_street_city ON address (source_street, source_city)',),
+    'errors': ('CREATE INDEX IF NOT EXISTS idx_errors_street_city ON errors (source_street, source_city)',),
+    'google_result': ('CREATE INDEX IF NOT EXISTS idx_google_result_lat_lng ON google_result (lat, lng)',),
+    # caseload database
+    'Household_Visit_Table': ('CREATE INDEX IF NOT EXISTS idx_hh_visit_key ON Household_Visit_Table (Visit_Number_Key)',),
+    'Visit_Coordinates_Table': ('CREATE INDEX IF NOT EXISTS idx_visit_coord_key ON Visit_Coordinates_Table (Visit_Number_Key)',),
+}
+
+def set_pragmas(conn):
+    '''
+    applies the PRAGMAS to the connection conn.
+    A pragma that cannot be applied (i.e. the database is read only or
+    locked by another process) is skipped
+    '''
+    for pragma in PRAGMAS:
+        try:
+            conn.execute(pragma).fetchall()
+        except sqlite3.DatabaseError as p_err:
+            print(f'could not apply {pragma}: {p_err}')
+
+def create_indexes(conn):
+    '''
+    creates the INDEXES for the tables that are in the database that conn
+    is connected to and returns a list of the tables that were indexed
+    '''
+    tables = {x[0] for x in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table'")}
+    indexed = []
+    for table in INDEXES:
+        if table in tables:
+            for statement in INDEXES[table]:
+                try:
+                    conn.execute(statement)
+                except sqlite3.DatabaseError as i_err:
+                    print(f'could not index {table}: {i_err}')
+            indexed.append(table)
+    conn.commit()
+    return indexed
+
+def migrate(conn):
+    '''
+    sets the pragmas and creates any missing indexes on an open
+    connection.  It is safe to call more than once
+    '''
+    set_pragmas(conn)
+    return create_indexes(conn)
+
+def migrate_file(path_name):
+    '''
+    opens the database at path_name, migrates it and closes it again
+    '''
+    conn = sqlite3.connect(path_name)
+    try:
+        indexed = migrate(conn)
+        print(f'{path_name}: indexes checked on {indexed}')
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python3 db_migrations.py database.db [database.db ...]')
+        sys.exit(1)
+    for db_file in sys.argv[1:]:
+        migrate_file(db_file)
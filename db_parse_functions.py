@@ -4,12 +4,18 @@ to parse or organize different bits of data contained in the lines
 of a l2f export
 
 '''
-s_diets = ['halal','diabetic','gluten free',
+from functools import lru_cache
+
+s_diets = ('halal','diabetic','gluten free',
            'no pork','vegetarian','vegan',
            'nursing','pregnant',
            'peanut allergy','dairy allergy',
            'lactose intollerant', 'wheat allergy'           
-          ]
+          )
+
+# how many different values the memoized parsers remember.  The same few
+# phone numbers, dates and diets come up over and over in an export
+NORMALIZER_CACHE_SIZE = 4096
 
 def itr_joiner(list_etc):
     '''
@@ -46,13 +52,16 @@ def hamper_type_parser(days_of_food):
     '''
     return days_of_food > 1
         
+@lru_cache(maxsize=NORMALIZER_CACHE_SIZE)
 def diet_parser(diet_string, special_diets=s_diets):
     '''
     this function returns the string of redundant dietary conditions
     minus the redundant conditions and the conditions tha are not relevant
     to the boxes we are putting together
-    param special diets is a list of the dietary conditions that merit
+    param special diets is a tuple of the dietary conditions that merit
     inclusion in the output we wish to print
+
+    results are memoized so the parameters need to be hashable
     '''
     diet_conditions = set(diet_string.lower().split(',')) # a unique list of conditions split on the commas
     out_put_s = []
@@ -83,36 +92,36 @@ def create_list_of_family_members_as_tuples(family_range_frm_visit, len_of_famil
     can then be turned into Person objects
     :param: len_of_family_sub_slice = number generated by Field_Names 
     that indicates the length of the family member details on the visit line
-    :param: h_d = a dictionary created by the Field_Names object to locate
-    the indexes of where the key bits of info are located.  This avoids
+    :param: h_d = the offsets of the key bits of info inside each family
+    members details.  Either the .member_offsets tuple of an Export_Schema
+    or the older dictionary of header: index value pairs from
+    Field_Names.return_fam_header_indexes().  This avoids
     having to manually calibrate where items are and allows the use of 
-    exports that have super.  It is made up of header: index value 
-    pairs this function uses to find the values 
+    exports that have super.  An offset of None means that header was not
+    used and None is put in its place
 
-    returns a list of tuples or an empty list
+    returns a list of tuples or an empty list.  The list is empty if
+    len_of_family_sub_slice is None (the export has no family members)
 
     '''
-    # create a nested list of family member chunks via the extract_families function
-    nested_list_of_family_data = [x for x in extract_families_into_list_slices(family_range_frm_visit, len_of_family_sub_slice)]    
+    if not len_of_family_sub_slice:
+        return []
+    if isinstance(h_d, dict):
+        offsets = tuple(v if v or v == 0 else None for v in h_d.values())
+    else:
+        offsets = h_d
     
     list_of_family_member_tuples = [] # where we will hold on to the tuples
-    # checks to see that the slice of family data is the right length and 
-    # avoid index errors
-    it_is_a_full_slice = lambda x : len(x) == len_of_family_sub_slice # return True if len x == 11
- 
-    for family_member in nested_list_of_family_data:
-        if it_is_a_full_slice(family_member): # if it is a full list then proceed 
-    
-            f_set = [] # container for building the slice
-            for k in h_d.keys(): # for key in dictionary of header: index
-                if h_d.get(k, False) or h_d.get(k, False) == 0: # see if there is a value or None
-                    f_set.append(family_member[h_d[k]]) # if so append the datapoint in the slice
-                else:
-                    # otherwise swap None in because that header was not used
-                    f_set.append(None) 
+    # step through the family member chunks, only looking at full ones
+    # to avoid index errors, and pull each datapoint straight out by its
+    # offset from the start of the chunk
+    last_start = len(family_range_frm_visit) - len_of_family_sub_slice
+    for start in range(0, last_start + 1, len_of_family_sub_slice):
+        f_set = tuple(None if o is None else family_range_frm_visit[start + o]
+                      for o in offsets)
         
-            if any(f_set):
-                list_of_family_member_tuples.append(tuple(f_set)) # add the tuple 
+        if any(f_set):
+            list_of_family_member_tuples.append(f_set) # add the tuple 
     
     # ID, Lname, Fname, DOB, Age, Gender, Ethnicity, Identity,relationship,
     # immigration date
@@ -5,6 +5,7 @@
 # aggregation functions. 
 #####################################################################
 
+from shapely import STRtree, points, prepare
 from shapely.geometry import MultiPoint, Point
 import sqlite3
 from tinydb import TinyDB, Query
@@ -19,6 +20,8 @@ class Neighbourhoods():
         self.db = TinyDB(path_to_tdb)
         self.kw_neighbourhoods = None
         self.nhood_shapes = {}
+        self.names = [] # the names of the shapes in the tree in order
+        self.tree = None # STRtree of the shapes made by .shape_tree()
             # avoid the new to manually open and set
         if self.db:
             self.kw_neighbourhoods = self.db.all()
@@ -43,24 +46,55 @@ class Neighbourhoods():
         keyed off the neighbourhoods.  This methods gets at both Kitchener and Waterloo
         neighbourhoods
         '''
+        self.tree = None
         for district in self.kw_neighbourhoods:
             name = district['name']
             shape = MultiPoint([(x[0], x[1]) for x in district['coords']]).convex_hull
             self.nhood_shapes[name] = shape
     
+    def shape_tree(self):
+        '''
+        returns an STRtree of the prepared shapes in the dictionary of shapes
+        so that a point is only tested against the shapes whose bounding boxes
+        it falls in.  It is made again if the dictionary has changed
+        '''
+        if self.tree is None or len(self.names) != len(self.nhood_shapes):
+            self.names = list(self.nhood_shapes.keys())
+            shapes = list(self.nhood_shapes.values())
+            prepare(shapes)
+            self.tree = STRtree(shapes)
+        return self.tree
+
     def find_in_shapes(self, lat, lng):
         '''
-        takes a lat, lng and iterates through the dictionary of shapes
+        takes a lat, lng and looks it up in the tree of shapes
         returns either the string name of the neighbourhood that the 
         points are in, or False
+        if the point is in more than one of the shapes it is the last one in
+        the dictionary of shapes
+        '''
+        point = Point((lat, lng)) # initialize a shapely Point
+        found = self.shape_tree().query(point, predicate='within')
+        if len(found):
+            return self.names[found.max()]
+        return False # kitchener names r in CAPS, Waterloo Normal Case
+
+    def find_all_in_shapes(self, coordinates):
+        '''
+        takes a list of (lat, lng) and looks them all up in the tree of
+        shapes in one go
+        returns a list with the name of the neighbourhood or False for each
+        of them in the same order, the same as calling .find_in_shapes()
+        on each one
         '''
-        location = (lat, lng)
-        point = Point(location) # initialize a shapely Point
-        in_neighbourhood = False
-        for neighbourhood in self.nhood_shapes.keys():
-            if point.within(self.nhood_shapes[neighbourhood]):
-                in_neighbourhood = neighbourhood
-        return in_neighbourhood # kitchener names r in CAPS, Waterloo Normal Case
+        found = [-1] * len(coordinates)
+        if coordinates:
+            in_point, in_shape = self.shape_tree().query(points(coordinates),
+                                                         predicate='within')
+            for point, shape in zip(in_point.tolist(), in_shape.tolist()):
+                if shape > found[point]:
+                    found[point] = shape
+        return [self.names[x] if x >= 0 else False for x in found]
 
     def __str__(self):
         return 'container for shapes populated with {} entries'.format(len(self.nhood_shapes))
@@ -81,5 +115,6 @@ if __name__ == '__main__':
     lat, lng = 43.456692, -80.511280 # the hospital
     zone = kw.find_in_shapes(lat, lng)
     print(zone) # should be KW HOSPITAL
+    print(kw.find_all_in_shapes([(lat, lng), (0, 0)])) # [KW HOSPITAL, False]
 
 
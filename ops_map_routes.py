@@ -9,7 +9,9 @@ from folium.plugins import MarkerCluster
 from basket_sorting_Geocodes import Route_Database
 from collections import namedtuple
 from ops_print_routes import Service_Database_Manager
-from address_parser_and_geocoder import full_address_parser
+from address_parser_and_geocoder import stored_address_parser
+from address_parser_and_geocoder import Parse_Store
+from address_parser_and_geocoder import PARSE_STORE_NAME
 
 D_FOLDER = 'databases/'
 R_SOURCE = f'{D_FOLDER}2019_production_rdb.db'
@@ -17,6 +19,12 @@ DEF_LOC =(43.465837, -80.482006) # default start location
 OUT_DIR = 'products/'
 DEF_MAP_NAME =f'{OUT_DIR}Route_Map_{datetime.now().strftime("%m-%d %H %M %S")}.html' 
 
+# address parses from earlier runs.  opens on first use
+parse_store = Parse_Store(f'{D_FOLDER}{PARSE_STORE_NAME}')
+
+hh_dat = namedtuple('hh_dat', 
+    'main_app_ID, family_size, diet, lat, lng, neighbourhood, rn, rl, gan, gat ')
+
 def simplify_address(add_string):
     '''
     strips out some of the extra junk around the address
@@ -24,7 +32,8 @@ def simplify_address(add_string):
     negative results
     '''
     try:
-        _, _, parsed_address = full_address_parser(add_string, '111111')
+        _, _, parsed_address = stored_address_parser(add_string, '111111',
+                                                     parse_store)
         simple_address, _ = parsed_address
         return simple_address
     except KeyboardInterrupt:
@@ -51,8 +60,6 @@ def get_hh_data(drt, rdbm):
     # 0 file_id, 1 f_name, 2 l_name, 3 family_size, 4 phone, 5 email, 6 address_1,
     # 7 address_2, 8 city, 9 postal, 10 diet, 11 neighbourhood, 12 sms_target
 
-    hh_dat = namedtuple('hh_dat', 
-        'main_app_ID, family_size, diet, lat, lng, neighbourhood, rn, rl, gan, gat ')
     street_str = simplify_address(main_applicant[6])
 
     l1_city = (street_str, main_applicant[8])
@@ -274,6 +281,7 @@ def make_custom_route_map(dbase_src=R_SOURCE, s_filter=None):
     make_map_custom_MarkerCluster(m)
     # close databases
     rdbm.close_all()
+    parse_store.close()
 
 def make_route_map(dbase_src=R_SOURCE):
     '''
@@ -313,6 +321,7 @@ def make_route_map(dbase_src=R_SOURCE):
     make_map_MarkerCluster(locations, labels)
 
     rdbm.close_all()
+    parse_store.close()
 
 
 def main():
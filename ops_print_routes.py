@@ -14,6 +14,7 @@ import logging
 import sys
 import sqlite3
 from collections import namedtuple
+from collections import defaultdict
 from datetime import datetime
 
 from r_config import configuration
@@ -32,6 +33,7 @@ from db_data_models import Field_Names
 from db_data_models import Visit_Line_Object
 from db_data_models import Export_File_Parser
 from db_data_models import Person
+from db_data_models import visit_sum # summary a la. VLO.get_HH_summary()
 from db_parse_functions import itr_joiner
 
 from kw_neighbourhoods import Neighbourhoods
@@ -45,6 +47,12 @@ from sponsor_reports import Report_File
 SERVICE_TABLE_KEYS = {'KW Salvation Army': 'Appointments',
                         'Salvation Army - Cambridge': 'CSA'}
 
+# use a named tuple to alias all the fields of an applicants table row
+#file, firstn, lastn familysize, phone, email,
+#address line 1, address line 2, city, postal code, diet, hood, sms_number
+add_h = namedtuple('add_h', 'f, fn, ln, fs, ph, em,\
+                   a1, a2, ct, po, di, ne, sms')
+
 # INITIALIZE CONFIGURATION FILE
 conf = configuration.return_r_config()
 target = conf.get_target() # source file
@@ -442,6 +450,190 @@ class Service_Database_Manager:
         except:
             return False, False
 
+    def attach(self, database, other, alias):
+        '''
+        attaches the database file held under key other to the connection
+        for key database as alias so that one query can JOIN tables from
+        both.  i.e. .attach('rdb', 'sa', 'sa') lets the route database
+        query sa.Appointments
+
+        returns the set of table names in the attached database
+        '''
+        conn = self.db_struct[database].conn
+        attached = {x[1] for x in conn.execute('PRAGMA database_list')}
+        if alias not in attached:
+            conn.execute(f'ATTACH DATABASE ? AS {alias}',
+                         (self.db_path_dict[other],))
+        ls = f"SELECT name FROM {alias}.sqlite_master WHERE type='table'"
+        return {x[0] for x in conn.execute(ls)}
+
+    def return_route_households(self, database, app_db, low, high, provider):
+        '''
+        does the work of get_main_applicant(), return_sa_info_pack() and
+        return_sponsors() for every household with a route number between
+        low and high in one query against the route database with the
+        appointment database attached
+
+        yields (file_id, rn, rl, main_applicant, sponsors, gan, gat) in the
+        order the routes were logged where
+        main_applicant = the applicants table row or None
+        sponsors = [(food, gift, voucher, turkey)] or [] if not sponsored
+        gan, gat = appointment number and 'day at time' string or False
+        the same as return_sa_info_pack()
+        '''
+        sa_tables = self.attach(database, app_db, 'app_db')
+        table_select = SERVICE_TABLE_KEYS.get(provider, None)
+        # the gift appointment columns are NULL when there is nothing to
+        # look them up in
+        gift_cols = 'NULL, NULL, NULL, NULL, NULL'
+        gift_join = ''
+        if table_select:
+            gift_cols = 'g.file_id, g.app_num, NULL, NULL, NULL'
+            gift_join = '''LEFT JOIN gift_table AS g
+                           ON g.file_id = r.file_id AND g.provider = :provider'''
+            if table_select in sa_tables:
+                gift_cols = 'g.file_id, g.app_num, t.ID, t.day, t.time'
+                gift_join = f'''{gift_join}
+                           LEFT JOIN app_db.{table_select} AS t
+                           ON t.ID = g.app_num'''
+
+        ls = f'''SELECT r.file_id, r.route_number, r.route_letter,
+                 a.*, s.file_id, s.food_sponsor, s.gift_sponsor,
+                 s.voucher_sponsor, s.turkey_sponsor, {gift_cols}
+                 FROM routes AS r
+                 LEFT JOIN applicants AS a ON a.file_id = r.file_id
+                 LEFT JOIN sponsor AS s ON s.file_id = r.file_id
+                 {gift_join}
+                 WHERE r.route_number >= :low AND r.route_number <= :high
+                 ORDER BY r.rowid'''
+        cur = self.db_struct[database].conn.execute(ls, {'low': low,
+                                                         'high': high,
+                                                         'provider': provider})
+        for row in cur:
+            fid, rn, rl = row[0:3]
+            main_applicant = row[3:16] if row[3] is not None else None
+            sponsors = [row[17:21]] if row[16] is not None else []
+            g_fid, app_num, t_id, a_day, a_time = row[21:26]
+            gan, gat = False, False
+            if table_select:
+                if g_fid is not None:
+                    gan = app_num
+                if t_id is not None:
+                    gat = f'{a_day} at {a_time}'
+            yield (fid, rn, rl, main_applicant, sponsors, gan, gat)
+
+    def return_route_families(self, database, low, high):
+        '''
+        returns the family members of every household with a route number
+        between low and high in one query as a dictionary of
+        {main applicant file id: [(client_id, fname, lname, age, gender)]}
+        '''
+        ls = '''SELECT f.main_applicant, f.client_id, f.fname, f.lname, f.age,
+                f.gender
+                FROM family AS f
+                INNER JOIN routes AS r ON r.file_id = f.main_applicant
+                WHERE r.route_number >= ? AND r.route_number <= ?
+                ORDER BY f.rowid'''
+        families = defaultdict(list)
+        for row in self.db_struct[database].conn.execute(ls, (low, high)):
+            families[row[0]].append(row[1:])
+        return families
+
+    def return_sponsor_households(self, database, app_db, crit=None):
+        '''
+        the sponsor table version of return_route_households()
+        does the work of return_sponsor_hh(), get_main_applicant(),
+        return_sa_info_pack(), return_pu_package() and return_pu_time() for
+        every sponsored household in one query against the route database
+        with the appointment database attached
+
+        param crit is a date in the format of YYYY-MM-DD and limits the
+        households to the ones sorted on that date
+
+        yields (sponsors, main_applicant, gan, gat, pickup) in the order
+        of the sponsor table where
+        sponsors = (file_id, food, gift, voucher, turkey, sorting_date)
+        main_applicant = the applicants table row or None
+        gan, gat = appointment number and 'day at time' string or False
+        pickup = (zone, zone number, zone date, zone time) where the zone
+        and number are False if the hh is not in the pickup table and the
+        date and time are False if there is no matching Zones slot
+        '''
+        sa_tables = self.attach(database, app_db, 'app_db')
+        # one LEFT JOIN for each gift appointment table.  Which one applies
+        # depends on the gift sponsor of the row
+        gift_tables = [t for t in SERVICE_TABLE_KEYS.values() if t in sa_tables]
+        gift_cols = ''
+        gift_joins = ''
+        for n, table in enumerate(gift_tables):
+            gift_cols = f'{gift_cols}, t{n}.ID, t{n}.day, t{n}.time'
+            gift_joins = f'''{gift_joins}
+                 LEFT JOIN app_db.{table} AS t{n} ON t{n}.ID = g.app_num'''
+        zone_cols = 'NULL, NULL, NULL'
+        zone_join = ''
+        if 'Zones' in sa_tables:
+            zone_cols = 'z.ID, z.day, z.time'
+            zone_join = 'LEFT JOIN app_db.Zones AS z ON z.ID = p.pu_num'
+        where = ''
+        if crit:
+            where = 'WHERE date(s.sorting_date) = date(:crit)'
+
+        ls = f'''SELECT s.file_id, s.food_sponsor, s.gift_sponsor,
+                 s.voucher_sponsor, s.turkey_sponsor, s.sorting_date,
+                 a.*, g.file_id, g.app_num, p.file_id, p.pu_zone, p.pu_num,
+                 {zone_cols}{gift_cols}
+                 FROM sponsor AS s
+                 LEFT JOIN applicants AS a ON a.file_id = s.file_id
+                 LEFT JOIN gift_table AS g
+                 ON g.file_id = s.file_id AND g.provider = s.gift_sponsor
+                 LEFT JOIN pickup_table AS p ON p.file_id = s.file_id
+                 {zone_join}{gift_joins}
+                 {where}
+                 ORDER BY s.rowid'''
+        cur = self.db_struct[database].conn.execute(ls, {'crit': crit})
+        for row in cur:
+            sponsors = row[0:6]
+            main_applicant = row[6:19] if row[6] is not None else None
+            g_fid, app_num, p_fid, zone, zn_num, z_id, z_day, z_time = row[19:27]
+            gan, gat = False, False
+            table_select = SERVICE_TABLE_KEYS.get(sponsors[2], None)
+            if table_select:
+                if g_fid is not None:
+                    gan = app_num
+                if table_select in gift_tables:
+                    n = 27 + gift_tables.index(table_select) * 3
+                    t_id, a_day, a_time = row[n:n + 3]
+                    if t_id is not None:
+                        gat = f'{a_day} at {a_time}'
+            if p_fid is None:
+                zone, zn_num = False, False
+            zone_date, zone_time = False, False
+            if z_id is not None:
+                zone_date, zone_time = z_day, z_time
+            yield (sponsors, main_applicant, gan, gat,
+                   (zone, zn_num, zone_date, zone_time))
+
+    def return_sponsor_families(self, database, crit=None):
+        '''
+        returns the family members of every household in the sponsor table
+        (sorted on the date crit if it is given) in one query as a
+        dictionary of
+        {main applicant file id: [(client_id, fname, lname, age, gender)]}
+        '''
+        where = ''
+        if crit:
+            where = 'WHERE date(s.sorting_date) = date(:crit)'
+        ls = f'''SELECT f.main_applicant, f.client_id, f.fname, f.lname, f.age,
+                f.gender
+                FROM family AS f
+                INNER JOIN sponsor AS s ON s.file_id = f.main_applicant
+                {where}
+                ORDER BY f.rowid'''
+        families = defaultdict(list)
+        for row in self.db_struct[database].conn.execute(ls, {'crit': crit}):
+            families[row[0]].append(row[1:])
+        return families
+
     def return_geo_points(self, add_tuple, database='address'):
         '''
         param database is the Address database
@@ -489,26 +681,15 @@ def package_applicant(main, sa, rn, rl, die=None):
     and a route summary object
 
     '''
-    # use a named tuple to alias all the fields
-    #file, firstn, lastn familysize, phone, email,
-    #address line 1, address line 2, city, postal code, diet, hood, sms_number
-    ma = namedtuple('add_h', 'f, fn, ln, fs, ph, em,\
-                       a1, a2, ct, po, di, ne, sms')
-
-
-    # summary a la. VLO.get_HH_summary()
-    visit_sum = namedtuple('visit_sum', 'applicant, fname, lname, \
-                           size, phone, email, address, address2, city, \
-                           postal, diet, sa_app_num, sms_target')
     lat = None
     lng = None
 
     if main:
         a = None
         if not die:
-            a = ma(*main)
+            a = add_h(*main)
         else:
-            a = ma(main[0], main[1], main[2], main[3], main[4], main[5],\
+            a = add_h(main[0], main[1], main[2], main[3], main[4], main[5],\
                    main[6], main[7], main[8], main[9], die, main[11],\
                    main[12])
 
@@ -552,34 +733,28 @@ def get_hh_from_database(database, r_start=1, r_end=900,gift_prov='KW Salvation
     and structures them into a delivery_household_collection
     and returns that structure
 
+    the applicant, sponsor and gift appointment for every route come out of
+    one JOINed query and the family members out of another, rather than
+    a handful of queries per household
     '''
     rdbm = Service_Database_Manager.get_service_db() 
     rdbm.initialize_connections()
 
     dhc = Delivery_Household_Collection()
 
-    logged_routes = rdbm.return_route_range('rdb', r_start, r_end)
+    families = rdbm.return_route_families('rdb', r_start, r_end)
+    logged_routes = rdbm.return_route_households('rdb', 'sa', r_start, r_end,
+                                                 gift_prov)
 
     for drt in logged_routes: # for delivery route...
-    #print(applicant)
-        fid, rn, rl = drt
+        # main_applicant is a row from the applicants table
+        # gift appointment number (gan) gift app time (gat) or False, False
+        fid, rn, rl, main_applicant, sponsors, gan, gat = drt
+        if not main_applicant:
+            raise ValueError(f'{fid} is routed but is not in the applicants table')
 
-        main_applicant = rdbm.get_main_applicant('rdb', fid)[0]
-        # get gift appointment number (gan) gift app time (gat)
-        # or False, False
-        
-        # get geo points from address database
-        # main_applicant is a tuple from the database call
-        # position 6 and 8 are address line 1 string
-        # and City string
-        l1_city = (main_applicant[6], main_applicant[8])
-        gp = rdbm.return_geo_points(l1_city, 'address')
-        
         diet = main_applicant[10]
         
-        gan, gat = rdbm.return_sa_info_pack('rdb', 'sa', fid,gift_prov)
-        sponsors = rdbm.return_sponsors('rdb', fid)
-
         new_diet = reformat_diet(sponsors, diet)
 
         hh_package, rt_sp = package_applicant(main_applicant, gan, rn, rl,\
@@ -593,7 +768,7 @@ def get_hh_from_database(database, r_start=1, r_end=900,gift_prov='KW Salvation
         dhc.add_to_route_summary(rn, rt_sp)
         dhc.add_sponsors(fid, *sponsors)
 
-        fam = rdbm.get_family_members('rdb', fid)
+        fam = families.get(fid)
         if fam:
             dhc.add_hh_family(fid, fam)
 
@@ -74,38 +74,40 @@ def get_hh_from_sponsor_table(database,criteria=None):
     report or other products
     param: criteria should be a date formatted in standard SQL date format
     YYYY-MM-DD
-    this paramet is used by the .return_sponsor method to extract households
-    that were regisered after a certain date
+    this paramet is used by the .return_sponsor_households method to extract
+    households that were regisered after a certain date
+
+    everything about the households comes out of two queries (households
+    and family members) rather than half a dozen per household
     '''
     rdbm = Service_Database_Manager.get_service_db()
     rdbm.initialize_connections()
 
     dhc = Delivery_Household_Collection()
-    # get list of sonsor families and services from the database
-    sponsor_families = rdbm.return_sponsor_hh('rdb',crit=criteria)
-    # tuples of (fid, food sponsor, gift_sponsor)
-    for sfam in sponsor_families:
+    # family members of all the sponsor households in one go
+    families = rdbm.return_sponsor_families('rdb', crit=criteria)
+    # the sponsor families joined to their applicant, gift appointment
+    # and pickup info
+    sponsor_families = rdbm.return_sponsor_households('rdb', 'sa',
+                                                      crit=criteria)
+    no_pickup = 0
+    for sfam, main_applicant, gan, gat, pickup in sponsor_families:
         fid, f_sponsor, g_sponsor, voucher_sponsor, turkey_sponsor, sort_date = sfam
-        main_applicant = None
-        try:
-            main_applicant = rdbm.get_main_applicant('rdb', fid)[0]
-        except IndexError: # a real edge case from mucking about in the tables!
+        if not main_applicant: # a real edge case from mucking about in the tables!
             print(f'{fid} is not in the applicants table!')
             ops_logger.info(f'ERROR: {fid} is not in applicants! ERROR!')
-        # extract key datapoints from the different tables
         # GIFT APPOINTMENT INFO
-        # appointment number, 'date and time string'
-        gan, gat = rdbm.return_sa_info_pack('rdb', 'sa', fid, g_sponsor)
+        # gan, gat = appointment number, 'date and time string'
         # FOOD PICKUP APPOINTMENT INFO
-        zone, zn_num = rdbm.return_pu_package('rdb', fid)
-        zone_date, zone_time = rdbm.return_pu_time('sa', zn_num)
+        zone, zn_num, zone_date, zone_time = pickup
+        if zone is False:
+            no_pickup += 1
         
         # rewrap up all that data
         # derive a route card summary
         # at this point we won't have a rn, rl and this is not important to
         # convey to the applicant
         hh_package, _ = package_applicant(main_applicant, gan, None, None)
-        #print(hh_package)
         # add it to a delivery hh collection
         dhc.add_household(*hh_package)
         # add 
@@ -113,19 +115,14 @@ def get_hh_from_sponsor_table(database,criteria=None):
                          turkey_sponsor)
         dhc.add_hof_pu(fid, zone, zn_num)
         dhc.add_hof_pu_date_time(fid, zone_date, zone_time)
-        fam = rdbm.get_family_members('rdb', fid)
+        fam = families.get(fid)
         if fam:
             dhc.add_hh_family(fid, fam)
         if all((gan, gat)):
             dhc.add_sa_app_number(fid, gan, g_sponsor)
             dhc.add_sa_app_time(fid, gat)
-        #else:
-        #    print('there is no gan and gat')
-        #    print(f'gan: {gan} gat: {gat}')
-        #    q = input('pausing....')
-
-        #print(dhc.who_is(fid))
-        #bbb = input('pausing in print_sponsor')
+    if no_pickup:
+        print(f'{no_pickup} sponsored households are not in the pickup table')
     return dhc, rdbm
 
 def write_sponsor_reports(delivery_households, r_dbs, i_key='sa_app_num', pf='SA'):
@@ -30,6 +30,11 @@ The function calls go in this sequence
 parse_and_sort_file(export_file, address_dbase, k_w, delivery_households)
 sort_routes(route_database, delivery_households, routes)
 log_routes_to_database(route_database, delivery_households)
+record_line_hashes(route_database, delivery_households, hashes)
+
+with --incremental the lines of households that have not changed since
+they were last sorted into the route database are dropped before
+parse_and_sort_file() sees them
 
 there is a option to sort households into the database, or to do that
 and and to also sort delivery routes
@@ -37,11 +42,14 @@ and and to also sort delivery routes
 '''
 import sqlite3
 import argparse
+import hashlib
 import logging
 from collections import namedtuple
 from datetime import datetime
 import timeit
 import sys
+import multiprocessing
+import os
 
 from r_config import configuration
 
@@ -49,15 +57,22 @@ from basket_sorting_Geocodes import Delivery_Household
 from basket_sorting_Geocodes import Delivery_Routes
 from basket_sorting_Geocodes import Route_Database
 from basket_sorting_Geocodes import Delivery_Household_Collection
+from basket_sorting_Geocodes import SORT_ENGINES
 
 from address_parser_and_geocoder import SQLdatabase
 from address_parser_and_geocoder import AddressParser
+from address_parser_and_geocoder import parse_store_for
+from address_parser_and_geocoder import chunks
+from address_parser_and_geocoder import fast_path_stats
+from address_parser_and_geocoder import add_fast_path_stats
+from address_parser_and_geocoder import NEIGHBOURHOOD_SHAPES
 
 from db_data_models import Field_Names
 from db_data_models import Visit_Line_Object
 from db_data_models import Export_File_Parser
 from db_data_models import Person
 from db_data_models import SERVICE_AGENTS_KWSA
+from db_data_models import normalizer_stats
 
 from db_parse_functions import itr_joiner
 
@@ -77,6 +92,15 @@ from file_iface import Menu
 Client = namedtuple('Client', 'size location')
 Geolocation = namedtuple('Geolocation', 'lat long')
 
+# the datapoints registration_check() looks at to decide if a line is kept.
+# the rest of the line is only extracted if the line is used
+REGISTRATION_FIELDS = ('main_applicant_ID', 'foods_provided', 'items_provided',
+                       'xmas_notes', 'ex_reference')
+
+# PARALLEL PARSING
+PARSE_WORKERS = 1 # processes parsing lines.  1 parses them in this process
+PARSE_CHUNK = 200 # lines sent to a worker process at a time
+
 # LOGGING
 ops_logger = logging.getLogger('ops')
 ops_logger.setLevel(logging.INFO)
@@ -113,7 +137,7 @@ add_log.info('Running new session {}'.format(datetime.now()))
 # it then stores the main applicant info, address etc. as well as family 
 # member details for use later if needed.
 
-def registration_check(line):
+def registration_check(line, routed_from_set=False):
     '''
     operates on a line 
     by calling methods on the Visit_Line  
@@ -133,8 +157,12 @@ def registration_check(line):
         self.delivery_h = False # Designates a delivery hamper
         self.f_sponsor = None # a list
         self.g_sponsor = None # a list
+    routed_from_set checks the .routed_ids set of the route_database for
+    previous routes instead of querying the routes table.  Nothing is
+    routed while the file is parsed, so the answer is the same
     '''
-    line_object = Visit_Line_Object(line,fnames.ID, december_flag = True)
+    line_object = Visit_Line_Object(line,fnames.ID, december_flag = True,
+                                    fields=REGISTRATION_FIELDS)
 
     # HOF?
     # test to see if it is a Christmas Hamper - if so, flip toggles
@@ -158,11 +186,14 @@ def registration_check(line):
     # extract summary from the visit line 
     #summary = line_object.get_HH_summary() # a named tuple
     applicant = line_object.get_applicant_ID()
-    is_routed = route_database.prev_routed(applicant)
+    is_routed = route_database.prev_routed(applicant, from_set=routed_from_set)
     
     flags = (applicant, is_xmas, is_routed, with_sa, sponsored)
+    # a household edited since it was last sorted (--incremental) goes
+    # through again even if it has been routed, so its rows are rewritten
+    edited = Route_Database.route_key(applicant) in route_database.edited_ids
 
-    if (is_xmas and not is_routed) or (sponsored or with_sa):
+    if (is_xmas and not is_routed) or (sponsored or with_sa) or edited:
         return (line_object, flags)
     else:
         return (False, flags)
@@ -184,8 +215,68 @@ def check_address(line_object):
         nr_logger.error(f'{applicant} raised an error during address parse')
         return False
 
+def household_coordinates(line_object, simple_address, address_database):
+    '''
+    looks up the coordinates of the simple_address in the address database
+    returns (lat, lng, neighbourhood) where neighbourhood is None if it is
+    not in the neighbourhood table
+    raises ValueError if the address has not been geocoded yet
+    '''
+    city = line_object.get_HH_summary().city
+    crds = address_database.get_coordinates(simple_address, city)
+    lt, lg = crds.lat, crds.lng
+    if all([lt, lg]):
+        # if there is a previously geocoded address
+        # we can move ahead...
+        return (lt, lg, crds.neighbourhood)
+    else: # if we have not geocoded the address
+        # we need to raise and exception.  It is better to 
+        # run the geocoding script first and dealing with potential errors
+        address = line_object.get_HH_summary().address
+        raise ValueError(f'{address} has not been geocoded! Run the gc script 1st')
+
+def locate_household(line_object, simple_address, address_database, kw):
+    '''
+    looks up the coordinates of the simple_address in the address database
+    and the neighbourhood they fall in
+    returns (lat, lng, neighbourhood)
+    raises ValueError if the address has not been geocoded yet
+    '''
+    lt, lg, n_hood = household_coordinates(line_object, simple_address,
+                                           address_database)
+    if n_hood is None:
+        n_hood = kw.find_in_shapes(lt, lg) # find neighbourhood
+    return (lt, lg, n_hood)
+
+def locate_households(parsed, address_database, kw):
+    '''
+    takes a list of (line_object, flags, simple_address) and returns a list
+    of (line_object, flags, simple_address, location) where location is
+    (lat, lng, neighbourhood) or the error message if they could not be
+    looked up.  The neighbourhoods that are not in the address database
+    are found in one call to kw.find_all_in_shapes()
+    '''
+    located = []
+    coordinates = []
+    for line_object, flags, simple_address in parsed:
+        location = None
+        if line_object and simple_address:
+            try:
+                location = household_coordinates(line_object, simple_address,
+                                                 address_database)
+                if location[2] is None:
+                    coordinates.append(location[:2])
+            except Exception as errr:
+                location = str(errr)
+        located.append([line_object, flags, simple_address, location])
+    n_hoods = iter(kw.find_all_in_shapes(coordinates))
+    for line in located:
+        if isinstance(line[3], tuple) and line[3][2] is None:
+            line[3] = (*line[3][:2], next(n_hoods))
+    return [tuple(line) for line in located]
+
 def sort_types(line_object, simple_address, address_database, kw,\
-               delivery_households, flags):
+               delivery_households, flags, location=None):
     '''
     examines the hh and attempts to sort key data points into the correct part
     of the Delivery_Household_Collection() data structure
@@ -204,6 +295,10 @@ def sort_types(line_object, simple_address, address_database, kw,\
     logging is organized under the following headings
     applicant, hof_pu_zone, hof_pu_num, hof_del, food_sponsor, gift_sponsor,
     gift_pu_number,neighbourhood,lat,lng
+
+    location is the (lat, lng, neighbourhood) if a worker process has already
+    looked them up, or the error message if that failed.  If it is None
+    they are looked up here
     '''
     summary = line_object.get_HH_summary()
     address = summary.address
@@ -255,76 +350,71 @@ def sort_types(line_object, simple_address, address_database, kw,\
     try:
         # if it is the correct status but we do not have geo points then a step
         # in the application pipeline has been skipped and we should break
-        crds = address_dbase.get_coordinates(simple_address, city)   
-        lt, lg = crds.lat, crds.lng
-        if all([lt, lg]): 
-            # if there is a previously geocoded address
-            # we can move ahead...            
-            # insert base information needed to build a route and card
-            n_hood = k_w.find_in_shapes(lt, lg) # find neighbourhood
-                # create a HH object and insert the summary we need to build 
-                # a route (lt, lg)a route card(summary). 
-                # and later a route summary (n_hood)
-            hh_added = False
-            if any(requests):
-                delivery_flag = True # this identifies a delivery household...
-                pu_flag = False
-                if all((hof_zone, hof_pu_num)) and not line_object.delivery_h:
-                    pu_flag = True
-                    delivery_flag = False 
-                    ''' 
-                    if it is not a delivery household trip this flag.  It is used to 
-                    filter out delivery households in the delivery __iter__ method of the
-                    Delivery_Household collection.  This will prevent non delivery households
-                    from being routed. If it is True, there is a list of delivery targets 
-                    in to Delivery_Household_Collection() that the applicant file ID will 
-                    be added to
-                    However, since there are multiple service providers that do
-                    delivery - but only one that we are currently routing for -
-                    a check on provider is necessary to ensure that only
-                    routable households are included in the routing table
-                    '''
-                deliverables = [voucher_p, turkey_p, food_sponsor]
-                if 'House of Friendship Delivery' not in deliverables:
-                    pu_flag= True
-                    delivery_flag = False
-
-                delivery_households.add_household(applicant, None, 
-                                                  family_size,
-                                                  lt, lg, summary, 
-                                                  n_hood,
-                                                  food=delivery_flag)
-                ops_logger.info(f'added {applicant} to household {hof_zone} {hof_pu_num}')
-                # is a pickup?
-                if pu_flag:
-                    # set pickup flags on the Delivery_Household() itself
-                    delivery_households.add_hof_pu(applicant, 
-                                                   hof_zone, 
-                                                   hof_pu_num)
-                # add requests
-                food_s = None
-                delivery_s = delivery_fh_p 
-                pickup_s = line_object.food_req.get('Pickup Christmas Hamper', None)
-
-                if delivery_s:
-                    food_s = delivery_s
-                elif pickup_s:
-                    food_s = pickup_s
-                
-                delivery_households.add_sponsors(applicant, food_s, gifts_p,
-                                                 voucher_p, turkey_p)
-                hh_added = True
-                if all((with_sa, sa_app)):
-                    # add sa app number
-                    delivery_households.add_sa_app_number(applicant, sa_app, gifts_p)
-
-            # AND FINALLY...
-            return (True, type_flags)
-
-        else: # if we have not geocoded the address
-            # we need to raise and exception.  It is better to 
-            # run the geocoding script first and dealing with potential errors
-            raise ValueError(f'{address} has not been geocoded! Run the gc script 1st')
+        if location is None:
+            location = locate_household(line_object, simple_address,
+                                        address_database, kw)
+        elif isinstance(location, str): # the worker process hit an error
+            raise LookupError(location)
+        lt, lg, n_hood = location
+        # insert base information needed to build a route and card
+        # create a HH object and insert the summary we need to build 
+        # a route (lt, lg)a route card(summary). 
+        # and later a route summary (n_hood)
+        hh_added = False
+        if any(requests):
+            delivery_flag = True # this identifies a delivery household...
+            pu_flag = False
+            if all((hof_zone, hof_pu_num)) and not line_object.delivery_h:
+                pu_flag = True
+                delivery_flag = False 
+                ''' 
+                if it is not a delivery household trip this flag.  It is used to 
+                filter out delivery households in the delivery __iter__ method of the
+                Delivery_Household collection.  This will prevent non delivery households
+                from being routed. If it is True, there is a list of delivery targets 
+                in to Delivery_Household_Collection() that the applicant file ID will 
+                be added to
+                However, since there are multiple service providers that do
+                delivery - but only one that we are currently routing for -
+                a check on provider is necessary to ensure that only
+                routable households are included in the routing table
+                '''
+            deliverables = [voucher_p, turkey_p, food_sponsor]
+            if 'House of Friendship Delivery' not in deliverables:
+                pu_flag= True
+                delivery_flag = False
+
+            delivery_households.add_household(applicant, None, 
+                                              family_size,
+                                              lt, lg, summary, 
+                                              n_hood,
+                                              food=delivery_flag)
+            ops_logger.info(f'added {applicant} to household {hof_zone} {hof_pu_num}')
+            # is a pickup?
+            if pu_flag:
+                # set pickup flags on the Delivery_Household() itself
+                delivery_households.add_hof_pu(applicant, 
+                                               hof_zone, 
+                                               hof_pu_num)
+            # add requests
+            food_s = None
+            delivery_s = delivery_fh_p 
+            pickup_s = line_object.food_req.get('Pickup Christmas Hamper', None)
+
+            if delivery_s:
+                food_s = delivery_s
+            elif pickup_s:
+                food_s = pickup_s
+            
+            delivery_households.add_sponsors(applicant, food_s, gifts_p,
+                                             voucher_p, turkey_p)
+            hh_added = True
+            if all((with_sa, sa_app)):
+                # add sa app number
+                delivery_households.add_sa_app_number(applicant, sa_app, gifts_p)
+
+        # AND FINALLY...
+        return (True, type_flags)
     except Exception as errr:
         nr_logger.error(f'{applicant} has raised {errr} and was not added to delivery households')
         # add individual details for each family member to the d_h object
@@ -351,7 +441,100 @@ def check_family(line_object, delivery_households):
         nr_logger.error('{} has family, but they were not stored in dhh object, due to {}'.format(applicant, oops))
 
 
-def parse_and_sort_file(export_file, address_database, kw, delivery_households):
+###### PARALLEL PARSING ######
+
+# the registration check, address parse and neighbourhood lookup are cpu
+# bound and don't depend on the other lines, so they can be done for chunks
+# of lines in worker processes.  The workers only read from the databases
+# and everything that is sorted into the Delivery_Household_Collection is
+# done back in the main process in the order of the file
+
+worker_address_dbase = None # a read only SQLdatabase in each worker process
+# the last normalizer cache counts each worker sent back. {pid: stats}
+# the caches live in the workers and only grow, so the latest counts
+# from each one are its totals
+worker_normalizer_stats = {}
+
+def parse_worker_init(address_path):
+    '''
+    runs once in each worker process.  The worker is forked from the main
+    process so it has the fnames, route_database and k_w objects already
+    but it needs its own connection to the address database
+    '''
+    global worker_address_dbase
+    worker_address_dbase = SQLdatabase()
+    worker_address_dbase.connect_to(address_path, create=False, read_only=True)
+
+def parse_chunk(lines):
+    '''
+    runs in a worker process and returns a list of
+    (line_object, flags, simple_address, location) for the lines
+    where location is (lat, lng, neighbourhood) or the error message
+    if they could not be looked up, the fast path counts for the chunk
+    and the normalizer cache counts of this worker so far
+    '''
+    parsed = []
+    for line in lines:
+        line_object, flags = registration_check(line, routed_from_set=True)
+        simple_address = None
+        if line_object:
+            simple_address = check_address(line_object)
+        parsed.append((line_object, flags, simple_address))
+    address_parser.flush() # the pool can stop the worker once it returns
+    return (locate_households(parsed, worker_address_dbase, k_w),
+            fast_path_stats(reset=True), (os.getpid(), normalizer_counts()))
+
+def parse_in_pool(export_file, address_path, workers, chunk):
+    '''
+    sends chunks of lines from the export_file to a pool of worker
+    processes and yields the parsed lines in the order they are in the file
+    '''
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers, initializer=parse_worker_init,
+                      initargs=(address_path,)) as pool:
+        for parsed, fast_counts, (pid, cache_counts) in pool.imap(
+                parse_chunk, chunks(export_file, chunk)):
+            add_fast_path_stats(fast_counts)
+            worker_normalizer_stats[pid] = cache_counts
+            yield from parsed
+
+def normalizer_counts():
+    '''
+    returns {name: (hits, misses)} for the normalizer caches of this
+    process.  CacheInfo can't be pickled so the workers send these back
+    '''
+    return {name: (info.hits, info.misses)
+            for name, info in normalizer_stats().items()}
+
+def all_normalizer_stats():
+    '''
+    returns {name: (hits, misses)} for the normalizer caches of this
+    process added to the ones the parse workers sent back
+    '''
+    totals = normalizer_counts()
+    for counts in worker_normalizer_stats.values():
+        for name, (hits, misses) in counts.items():
+            total_hits, total_misses = totals.get(name, (0, 0))
+            totals[name] = (total_hits + hits, total_misses + misses)
+    return totals
+
+def parse_lines(export_file, address_database, kw, chunk):
+    '''
+    yields (line_object, flags, simple_address, location) for the lines of
+    the export_file parsed chunk lines at a time in this process
+    '''
+    for lines in chunks(export_file, chunk):
+        parsed = []
+        for line in lines:
+            line_object, flags = registration_check(line, routed_from_set=True)
+            simple_address = None
+            if line_object:
+                simple_address = check_address(line_object)
+            parsed.append((line_object, flags, simple_address))
+        yield from locate_households(parsed, address_database, kw)
+
+def parse_and_sort_file(export_file, address_database, kw, delivery_households,
+                        workers=PARSE_WORKERS, chunk=PARSE_CHUNK):
     '''
     takes an export_file object
     and iterates throught the lines of the file
@@ -360,14 +543,21 @@ def parse_and_sort_file(export_file, address_database, kw, delivery_households):
     -derive a simplified address and find geocoordinates from db
     -sort the line into different services and stores hh data
     in the appropriate data structures
+
+    with workers > 1 the first two steps are done by a pool of that many
+    processes, chunk lines at a time.  This needs the 'fork' start method
+    so on systems without it the lines are parsed in this process
     '''
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        parsed_lines = parse_in_pool(export_file, address_database.name,
+                                     workers, chunk)
+    else:
+        parsed_lines = parse_lines(export_file, address_database, kw, chunk)
 
-    for line in export_file:
-        line_object, flags = registration_check(line)
+    for line_object, flags, simple_address, location in parsed_lines:
         if line_object:
-            simple_address = check_address(line_object)
             if simple_address:
-                typed, type_flags = sort_types(line_object, simple_address,address_database, kw, delivery_households,flags)
+                typed, type_flags = sort_types(line_object, simple_address,address_database, kw, delivery_households,flags, location=location)
                 if typed:
                     check_family(line_object, delivery_households)
         else:
@@ -375,29 +565,125 @@ def parse_and_sort_file(export_file, address_database, kw, delivery_households):
             nr_logger.info(f'{applicant} is not ours? is xmas:{is_xmas} \
                            route:{is_routed} sa:{with_sa}')
 
-def sort_routes(route_database, delivery_households):
+###### INCREMENTAL RUNS ######
+
+# when a run has sorted and routed the households, a hash of each one's lines
+# in the export goes in the 'line_hashes' table.  The next export will have
+# mostly the same lines, so --incremental drops the lines of households
+# whose hash has not changed and only the new and edited ones are parsed,
+# sorted and inserted.  The whole line is hashed so that a change to any of
+# the services, notes, address or family columns is picked up
+
+def household_hashes(lines):
+    '''
+    returns a dictionary of {file_id: hash} with one hash of all the lines
+    for each main applicant in lines.  The file ids are made by
+    Route_Database.route_key() so they match the database
+    '''
+    id_index = fnames.ID['Client ID']
+    hashes = {}
+    for line in lines:
+        key = Route_Database.route_key(line[id_index])
+        if key not in hashes:
+            hashes[key] = hashlib.sha1()
+        hashes[key].update('\x1f'.join(line).encode('utf-8') + b'\x1e')
+    return {key: l_hash.hexdigest() for key, l_hash in hashes.items()}
+
+def changed_lines(lines, hashes, stored_hashes):
+    '''
+    returns the lines in lines belonging to households that are new or
+    whose hash is different from the one in stored_hashes
+    '''
+    id_index = fnames.ID['Client ID']
+    changed = []
+    for line in lines:
+        key = Route_Database.route_key(line[id_index])
+        if stored_hashes.get(key) != hashes[key]:
+            changed.append(line)
+    return changed
+
+def record_line_hashes(route_database, delivery_households, hashes):
+    '''
+    stores the hashes of the households that were sorted into the route
+    database on this run.  Households that did not make it into the
+    delivery_households (i.e. the address is not geocoded yet) and edited
+    households whose rows were not written again are left out so they are
+    tried again next time
+    '''
+    rows = []
+    for house in delivery_households:
+        key = Route_Database.route_key(house.main_app_ID)
+        if key in hashes and key not in route_database.edited_ids:
+            rows.append((key, hashes[key]))
+    route_database.add_line_hashes_bulk(rows)
+    return len(rows)
+
+def sort_routes(route_database, delivery_households, engine='grid',
+                routed_set=True):
     '''
     works through the delivery households and sorts them into routes
     if they have not been previously routed.
     finds a starting route number and then
     calls the sort_method of the database on the delivery_household_collection
+
+    engine picks the sort method. 'grid' uses the spatial index and 'brute'
+    uses the original distance to every household method
+    routed_set checks for previous routes in the file ids the route database
+    loaded when it was opened instead of querying it for each household
     '''
 
     # Configure the max number of boxes and
     # the starting route number and pass in the route database
     # for checking existing file numbers to see if they have been
     # previously routed
-    routes = Delivery_Routes(route_database, 7, 1)
+    routes = Delivery_Routes(route_database, 7, 1, routed_set=routed_set)
 
     tic = timeit.default_timer()
     print(f'ROUTE SORTING BEGIN: {str(datetime.now())}')
 
     starting_rn = route_database.return_last_rn() # find last rn
     routes.start_count = int(starting_rn) + 1 # reset rn to resume from last route
-    routes.sort_method(delivery_households) # start sorting
+    routes.sort_with(engine, delivery_households) # start sorting
     toc = timeit.default_timer()
-    print(f'ROUTES SORTED: it took {toc-tic} seconds')
+    print(f'ROUTES SORTED: it took {toc-tic} seconds using the {engine} engine')
     print(f'                 ...or {(toc-tic)/60} minutes')
+    for step, seconds in routes.timings.items():
+        print(f'                 {step}: {seconds} seconds')
+
+def applicant_tuple(house):
+    '''
+    returns the row for the 'applicants' table for a Delivery_Household
+    '''
+    applicant, rn, rl, n_hd = house.return_route()
+    # get the summary from the HH object
+    # created by the visit_line
+    summ = house.return_summary()  
+    # parse out the summary data
+    fname = summ.fname
+    lname = summ.lname
+    email = summ.email
+    phone = itr_joiner(summ.phone)
+    address = summ.address
+    add2 = summ.address2
+    city = summ.city
+    family_size = summ.size
+    diet = summ.diet
+    sms_target = summ.sms_target
+    postal = summ.postal
+    # add household to the summary data
+    return (applicant,
+            fname,
+            lname,
+            family_size,
+            phone,
+            email,
+            address,
+            add2,
+            city,
+            postal,
+            diet,
+            n_hd,
+            sms_target,)
 
 def family_to_db(house, route_database):
     '''
@@ -408,42 +694,23 @@ def family_to_db(house, route_database):
     to determine if the HH has requested a service
     and if so, will add the family details to the database
 
+    a household in route_database.edited_ids has its rows replaced
+    instead, since the ones in the database are out of date
+
     '''
-    applicant, rn, rl, n_hd = house.return_route()
+    applicant = house.main_app_ID
+
+    if Route_Database.route_key(applicant) in route_database.edited_ids:
+        people = [Person(person).get_base_profile()
+                  for person in house.family_members or ()]
+        route_database.replace_household(applicant_tuple(house), people)
+        ops_logger.info('{} was edited and has been logged to applicants db again'.format(applicant))
+        return
 
     # ADD MAIN APPLICANT AND HOUSEHOLD INFO
     # ADDRESS ET AL TO THE APPLICANTS TABLE  
     if not route_database.fam_prev_entered(applicant):
-
-        # get the summary from the HH object
-        # created by the visit_line
-        summ = house.return_summary()  
-        # parse out the summary data
-        fname = summ.fname
-        lname = summ.lname
-        email = summ.email
-        phone = itr_joiner(summ.phone)
-        address = summ.address
-        add2 = summ.address2
-        city = summ.city
-        family_size = summ.size
-        diet = summ.diet
-        sms_target = summ.sms_target
-        postal = summ.postal
-        # add household to the summary data
-        app_tupe = (applicant,
-                    fname,
-                    lname,
-                    family_size,
-                    phone,
-                    email,
-                    address,
-                    add2,
-                    city,
-                    postal,
-                    diet,
-                    n_hd,
-                    sms_target,)
+        app_tupe = applicant_tuple(house)
         ops_logger.info(f'{app_tupe}')
         route_database.add_family(app_tupe) 
         ops_logger.info('{} has been logged to applicants db'.format(applicant))
@@ -452,16 +719,18 @@ def family_to_db(house, route_database):
     # need to do a check in the database to verify that they have not been
     # added already
     if house.family_members:
+        new_members = []
         for person in house.family_members:
             pid = person[0]
             if not route_database.fam_member_prev_entered(pid):
                 person_o = Person(person)
                 # insert ID, Fname, Lname, Age
-                base = person_o.get_base_profile()
-                route_database.add_family_member(applicant,base)
+                new_members.append(person_o.get_base_profile())
                 ops_logger.info('added {} to family db table'.format(person))
             else:
                 ops_logger.info('{} already exists in family table'.format(pid))
+        if new_members:
+            route_database.add_family_members_bulk(applicant, new_members)
 
 
 
@@ -561,19 +830,41 @@ def insert_request_to_db(route_database, delivery_households):
     fall through, or log them to the db if they are reg. for
     sponsor and/or sa services
 
+    the writes are made in one .batch() so the database is committed once
+    at the end rather than after every row
     '''
     # populate the database with summary and route data
-    for house in delivery_households:
-        applicant, rn, rl, n_hd = house.return_route()
-        # if a route, insert it to db         
-        rt_to_db(rn, rl, house, route_database)
-
-        # if sponsored, insert it to db
-        #sa_app_num, f_sponsor, g_sponsor = house.return_sponsor_package()
-        sponsors_to_db(applicant, house, route_database)
-        
-        # if a pickup, insert it to db
-        pu_to_db(applicant, house, route_database)
+    with route_database.batch():
+        for house in delivery_households:
+            applicant, rn, rl, n_hd = house.return_route()
+            # if a route, insert it to db         
+            rt_to_db(rn, rl, house, route_database)
+
+            # if sponsored, insert it to db
+            #sa_app_num, f_sponsor, g_sponsor = house.return_sponsor_package()
+            sponsors_to_db(applicant, house, route_database)
+            
+            # if a pickup, insert it to db
+            pu_to_db(applicant, house, route_database)
+
+            # if edited since it was last sorted and none of the above
+            # wrote it (i.e. it was routed on an earlier run) write it now
+            if Route_Database.route_key(applicant) in route_database.edited_ids:
+                family_to_db(house, route_database)
+
+# COMMAND LINE OPTIONS
+cli = argparse.ArgumentParser(description='sort a l2f export into routes')
+cli.add_argument('--engine', choices=SORT_ENGINES, default='grid',
+                 help='route sorting engine')
+cli.add_argument('--query-routes', action='store_true',
+                 help='query the routes table for each household while sorting')
+cli.add_argument('--workers', type=int, default=PARSE_WORKERS,
+                 help='processes used to parse the lines of the file')
+cli.add_argument('--chunk', type=int, default=PARSE_CHUNK,
+                 help='lines sent to a parsing process at a time')
+cli.add_argument('--incremental', action='store_true',
+                 help='skip households that have not changed since the last run')
+args = cli.parse_args()
 
 # CONFIGURATION SETUP
 conf = configuration.return_r_config()
@@ -606,32 +897,57 @@ elif str(step_2) != '1':
     sys.exit(0)
 
 # CONFIG AND SETUP of objects 
-address_parser = AddressParser() # I strip out extraneous junk from address strings
+# I strip out extraneous junk from address strings
+address_parser = AddressParser(store=parse_store_for(f'{db_src}Address.db'))
+
+k_w = Neighbourhoods(NEIGHBOURHOOD_SHAPES)
+k_w.extract_shapes() # get shapes ready to test points
 
 address_dbase = SQLdatabase() # I recieve the geocoded information from parsed address strings
 address_dbase.connect_to(f'{db_src}Address.db', create=True) # testing = atest.db
+# coordinates geocoded before the neighbourhood table existed
+filled = address_dbase.fill_neighbourhoods(k_w)
+if filled:
+    print(f'added neighbourhoods for {filled} coordinates to the address database')
 
 route_database = Route_Database(f'{db_src}{session}rdb.db')
 
 fnames = Field_Names(target) # I am header names
 export_file = Export_File_Parser(target, fnames) # I open a csv 
 export_file.open_file()
+export_lines = list(export_file)
+line_hashes = household_hashes(export_lines)
+if args.incremental:
+    total_lines = len(export_lines)
+    stored_hashes = route_database.load_line_hashes()
+    route_database.edited_ids = {key for key, l_hash in line_hashes.items()
+                                 if key in stored_hashes and stored_hashes[key] != l_hash}
+    export_lines = changed_lines(export_lines, line_hashes, stored_hashes)
+    print(f'--incremental: {len(export_lines)} of {total_lines} lines are new or changed')
 
 # delivery and sponsor households go into this object
 delivery_households = Delivery_Household_Collection()
 pickup_households = Delivery_Household_Collection()
 
-k_w = Neighbourhoods(r'City of Waterloo and Kitchener Planning district Geometry.json')
-k_w.extract_shapes() # get shapes ready to test points
-
 
 ### FUNCTION CALLS ###
 ### open, parse lines, sort into services, sort routes, log routes and sponsors
 ### to database
-parse_and_sort_file(export_file, address_dbase, k_w, delivery_households)
+parse_and_sort_file(export_lines, address_dbase, k_w, delivery_households,
+                    workers=args.workers, chunk=args.chunk)
+parse_stats = address_parser.cache_stats()
+add_log.info(f'address parse cache {parse_stats}')
+add_log.info(f'normalizer caches (hits, misses) {all_normalizer_stats()}')
+print(f'address fast path hit rate: {parse_stats["fast_path"]["hit_rate"]:.1%}')
+address_parser.close()
 if not skip_routing:
-    sort_routes(route_database, delivery_households)
+    sort_routes(route_database, delivery_households, engine=args.engine,
+                routed_set=not args.query_routes)
 insert_request_to_db(route_database, delivery_households)
+if not skip_routing:
+    # only a run that routes can mark the households as done.  After a
+    # parse only run the delivery households still need to be routed
+    record_line_hashes(route_database, delivery_households, line_hashes)
 
 # close databases
 route_database.close_db()